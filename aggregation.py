@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from typing import Dict, List, Sequence
+import numpy as np
+from weather_models import Forecast
+
+
+@dataclass(frozen=True, slots=True)
+class DailyForecast:
+    date: date
+    temp_min: float
+    temp_max: float
+    temp_mean: float
+    description: str
+    humidity: float
+    wind_max: float
+    precipitation: float
+
+
+@lru_cache(maxsize=1024)
+def forecast_columns(forecast: Forecast) -> Dict[str, np.ndarray]:
+    # 3-часовой ряд раскладывается в колонки один раз на снимок прогноза
+    points = forecast.points
+    count = len(points)
+    return {
+        'day': np.fromiter((point.time.toordinal() for point in points), dtype=np.int64, count=count),
+        'temp_min': np.fromiter((point.temp_min for point in points), dtype=np.float64, count=count),
+        'temp_max': np.fromiter((point.temp_max for point in points), dtype=np.float64, count=count),
+        'temp': np.fromiter((point.temp for point in points), dtype=np.float64, count=count),
+        'humidity': np.fromiter((point.humidity for point in points), dtype=np.float64, count=count),
+        'wind': np.fromiter((point.wind_speed for point in points), dtype=np.float64, count=count),
+        'precipitation': np.fromiter((point.precipitation for point in points), dtype=np.float64, count=count),
+        'description': np.array([point.description for point in points], dtype=object),
+    }
+
+
+def aggregate_daily(forecasts: Sequence[Forecast], days: int = 5) -> List[List[DailyForecast]]:
+    if not forecasts:
+        return []
+
+    columns = [forecast_columns(forecast) for forecast in forecasts]
+    sizes = np.array([len(column['day']) for column in columns])
+    joined = {name: np.concatenate([column[name] for column in columns]) for name in columns[0]}
+    owner = np.repeat(np.arange(len(forecasts)), sizes)
+
+    # Точки каждого прогноза отсортированы по времени, поэтому группы (город, день) идут подряд
+    boundary = np.ones(len(owner), dtype=bool)
+    boundary[1:] = (owner[1:] != owner[:-1]) | (joined['day'][1:] != joined['day'][:-1])
+    starts = np.flatnonzero(boundary)
+    group = np.cumsum(boundary) - 1
+    counts = np.diff(np.append(starts, len(owner)))
+
+    temp_min = np.minimum.reduceat(joined['temp_min'], starts)
+    temp_max = np.maximum.reduceat(joined['temp_max'], starts)
+    temp_mean = np.add.reduceat(joined['temp'], starts) / counts
+    humidity = np.add.reduceat(joined['humidity'], starts) / counts
+    wind_max = np.maximum.reduceat(joined['wind'], starts)
+    precipitation = np.add.reduceat(joined['precipitation'], starts)
+
+    # Преобладающее описание — самое частое в группе
+    labels, codes = np.unique(joined['description'].astype(str), return_inverse=True)
+    tally = np.bincount(group * len(labels) + codes, minlength=len(starts) * len(labels))
+    dominant = tally.reshape(len(starts), len(labels)).argmax(axis=1)
+
+    result: List[List[DailyForecast]] = [[] for _ in forecasts]
+    for index, start in enumerate(starts):
+        daily = result[owner[start]]
+        if len(daily) >= days:
+            continue
+        daily.append(DailyForecast(
+            date=date.fromordinal(int(joined['day'][start])),
+            temp_min=float(temp_min[index]),
+            temp_max=float(temp_max[index]),
+            temp_mean=float(temp_mean[index]),
+            description=str(labels[dominant[index]]),
+            humidity=float(humidity[index]),
+            wind_max=float(wind_max[index]),
+            precipitation=float(precipitation[index]),
+        ))
+    return result
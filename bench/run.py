@@ -0,0 +1,387 @@
+# Нагрузочный стенд без внешних сервисов: OpenWeather и Bot API подменяются
+# локальными заглушками из bench/stubs.py, Postgres — файлом SQLite.
+#
+#   python -m bench.run updates --users 2000 --concurrency 200
+#   python -m bench.run notifications --users 100000 --latency 0.05
+#   python -m bench.run notifications --users 1000000 --output bench_output.txt
+#   python -m bench.run notifications --users 50000 --workers 4 --abandon 2
+#
+# Результат — пропускная способность, p50/p99 задержки и пиковая память;
+# с --output строка JSON дописывается в файл для сравнения прогонов.
+import argparse
+import asyncio
+import concurrent.futures
+import dataclasses
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+import numpy as np
+from bench.stubs import FakeOpenWeather, FakeTelegram
+
+BOT_TOKEN = "123456:BENCH"
+
+
+def parse_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк бота на локальных заглушках")
+    parser.add_argument("scenario", choices=("updates", "notifications"))
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--cities", type=int, default=500, help="число разных городов у пользователей")
+    parser.add_argument("--id-share", type=float, default=0.9, help="доля пользователей с известным city_id")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременных чатов в сценарии updates")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка OpenWeather, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429 от OpenWeather")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка Bot API, с")
+    parser.add_argument("--fsm", choices=("database", "memory"), default="database")
+    parser.add_argument("--fsm-routing", choices=("shared", "sticky"), default="sticky")
+    parser.add_argument("--prefetch", action="store_true", help="прогреть кэш перед рассылкой")
+    parser.add_argument("--coordination", choices=("database", "local"), default="database")
+    parser.add_argument("--workers", type=int, default=1, help="процессов-рассыльщиков, делящих слот через аренды")
+    parser.add_argument("--abandon", type=int, default=0,
+                        help="шардов, брошенных упавшим рассыльщиком на середине")
+    parser.add_argument("--charts", action="store_true", help="запрашивать графики в сценарии updates")
+    parser.add_argument("--tracemalloc", action="store_true", help="считать пик аллокаций Python (медленнее)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="файл SQLite; по умолчанию временный")
+    parser.add_argument("--output", help="дописать результат строкой JSON в файл")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace, openweather_url: str, db_path: str) -> None:
+    # Конфиг читается при импорте модулей бота, поэтому окружение задаётся до него
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "OPENWEATHER_API_KEY": "bench",
+        "OPENWEATHER_BASE_URL": openweather_url,
+        "POSTGRES_URI": f"sqlite://{db_path}",
+        "FSM_STORAGE": args.fsm,
+        "FSM_ROUTING": args.fsm_routing,
+        "METRICS_PORT": "0",
+        # Ограничения настоящих сервисов стенд не меряет
+        "TELEGRAM_GLOBAL_RATE": "1000000",
+        "TELEGRAM_CHAT_INTERVAL": "0",
+        "OPENWEATHER_CALLS_PER_MINUTE": "1e9",
+        "OPENWEATHER_BURST": "1e9",
+        "NOTIFICATION_PREFETCH_MINUTES": "0",
+        "NOTIFICATION_COORDINATION": args.coordination,
+    })
+
+
+def make_bot(telegram_url: str):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    return Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(telegram_url)))
+
+
+def city_names(count: int) -> List[Tuple[str, int]]:
+    from gazetteer import get_gazetteer
+    known = [(city.name, city.id) for city in get_gazetteer().cities]
+    synthetic = [(f"Город {index}", 3_000_000 + index) for index in range(max(count - len(known), 0))]
+    return (known + synthetic)[:count]
+
+
+def summarize(scenario: str, count: int, elapsed: float, latencies: Sequence[float],
+              extra: Dict[str, Any]) -> Dict[str, Any]:
+    values = np.asarray(latencies) * 1000 if len(latencies) else np.zeros(1)
+    result = {
+        "scenario": scenario,
+        "count": count,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+        # ru_maxrss в Linux — в килобайтах
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if tracemalloc.is_tracing():
+        result["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1)
+    result.update(extra)
+    return result
+
+
+async def seed_users(count: int, minute: int, cities: List[Tuple[str, int]], id_share: float,
+                     seed: int, batch_size: int = 10_000) -> None:
+    from database.models import Users
+    rng = random.Random(seed)
+    for start in range(0, count, batch_size):
+        rows = []
+        for telegram_id in range(start + 1, min(start + batch_size, count) + 1):
+            city, city_id = rng.choice(cities)
+            rows.append(Users(
+                telegram_id=telegram_id,
+                username=f"user{telegram_id}",
+                first_name="Bench",
+                city=city,
+                city_id=city_id if rng.random() < id_share else None,
+                notification_minute=minute,
+                notification_utc_minute=minute,
+                notifications_enabled=True,
+            ))
+        await Users.bulk_create(rows)
+
+
+async def _notification_worker(slot: datetime.datetime, worker: str, reclaim: bool, barriers: Any) -> Dict[str, Any]:
+    import notifications
+    import openweather as openweather_client
+    from database import TORTOISE_ORM
+    from tortoise import Tortoise
+    from config import BOT_TOKEN as token
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    # Схему уже создал родительский процесс
+    await Tortoise.init(config=TORTOISE_ORM)
+    bot = Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(os.environ["BENCH_TELEGRAM_URL"])))
+    try:
+        if barriers:
+            # Рассыльщики делят прогрев слота, рассылка начинается, когда он закончен у всех
+            await notifications._prefetch_slot_leased(slot, 0, worker=worker)
+            for barrier in barriers:
+                await asyncio.to_thread(barrier.wait)
+        report = await notifications._send_slot_leased(bot, slot, worker=worker)
+        if reclaim:
+            # Ждем истечения брошенных аренд; досылает первый заметивший их рассыльщик
+            await asyncio.sleep(1.1)
+            await notifications._reclaim_abandoned(bot, slot + datetime.timedelta(minutes=1), worker=worker)
+        return dataclasses.asdict(report)
+    finally:
+        await bot.session.close()
+        await openweather_client.close()
+        await Tortoise.close_connections()
+
+
+def notification_worker(slot: datetime.datetime, worker: str, reclaim: bool, barriers: Any) -> Dict[str, Any]:
+    # Отдельный процесс со своим подключением к БД — как реплика бота
+    return asyncio.run(_notification_worker(slot, worker, reclaim, barriers))
+
+
+async def abandon_shards(slot: datetime.datetime, count: int) -> int:
+    # Упавший рассыльщик: взял шарды, успел доставить половину и не продлил аренду
+    import notifications
+    from config import NOTIFICATION_SHARDS
+    from database.leases import claim_lease, create_slot_leases, get_shard_users, record_deliveries
+    key = notifications._slot_key(slot)
+    await create_slot_leases(key, NOTIFICATION_SHARDS)
+    delivered = 0
+    for shard in range(min(count, NOTIFICATION_SHARDS)):
+        await claim_lease(key, shard, "bench-dead", 1)
+        due = await get_shard_users(slot.hour * 60 + slot.minute, NOTIFICATION_SHARDS, shard)
+        done = [telegram_id for telegram_id, _, _ in due[:len(due) // 2]]
+        await record_deliveries(key, shard, done)
+        delivered += len(done)
+    return delivered
+
+
+async def run_notifications(args: argparse.Namespace, telegram: FakeTelegram,
+                            openweather: FakeOpenWeather) -> Dict[str, Any]:
+    import notifications
+    from database.users import get_notification_schedule
+    from scheduler import schedule
+
+    slot = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+    minute = slot.hour * 60 + slot.minute
+
+    started = time.perf_counter()
+    await seed_users(args.users, minute, city_names(args.cities), args.id_share, args.seed)
+    seed_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    schedule.load(await get_notification_schedule())
+    load_time = time.perf_counter() - started
+
+    bot = make_bot(telegram.url)
+    multiprocess = args.coordination == "database" and (args.workers > 1 or args.abandon)
+    prefetch_time = 0.0
+    prefetch_calls: Dict[str, int] = {}
+    predelivered = 0
+    try:
+        if args.coordination == "database" and args.abandon:
+            predelivered = await abandon_shards(slot, args.abandon)
+        if args.prefetch and not multiprocess:
+            started = time.perf_counter()
+            if args.coordination == "database":
+                await notifications._prefetch_slot_leased(slot, 0, worker="bench-0")
+            else:
+                await notifications._prefetch_slot(slot, 0)
+            prefetch_time = time.perf_counter() - started
+            prefetch_calls = dict(openweather.calls)
+        openweather.calls.clear()
+        telegram.deliveries.clear()
+        telegram.recipients.clear()
+
+        # Одна итерация цикла send_weather_notifications — рассылка слота целиком
+        started = time.perf_counter()
+        if args.coordination == "local":
+            reports = [dataclasses.asdict(await notifications._send_slot(bot, slot))]
+        elif not multiprocess:
+            reports = [dataclasses.asdict(await notifications._send_slot_leased(bot, slot, worker="bench-0"))]
+        else:
+            os.environ["BENCH_TELEGRAM_URL"] = telegram.url
+            loop = asyncio.get_running_loop()
+            context = multiprocessing.get_context("spawn")
+            with context.Manager() as manager, concurrent.futures.ProcessPoolExecutor(
+                args.workers, mp_context=context
+            ) as pool:
+                # Два барьера: между ними стенд отделяет запросы прогрева от запросов рассылки
+                barriers = [manager.Barrier(args.workers + 1) for _ in range(2)] if args.prefetch else None
+                futures = [
+                    loop.run_in_executor(pool, notification_worker, slot, f"bench-{index}", bool(args.abandon), barriers)
+                    for index in range(args.workers)
+                ]
+                if barriers:
+                    await asyncio.to_thread(barriers[0].wait)
+                    prefetch_time = time.perf_counter() - started
+                    prefetch_calls = dict(openweather.calls)
+                    openweather.calls.clear()
+                    telegram.deliveries.clear()
+                    started = time.perf_counter()
+                    await asyncio.to_thread(barriers[1].wait)
+                reports = await asyncio.gather(*futures)
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+
+    return summarize("notifications", len(telegram.deliveries), elapsed,
+                     [at - started for at in telegram.deliveries], {
+        "users": args.users,
+        "workers": len(reports),
+        "shards_per_worker": [report["shards"] for report in reports],
+        "cities": sum(report["cities"] for report in reports),
+        "failed": sum(report["failed"] for report in reports),
+        "retries": sum(report["retries"] for report in reports),
+        "predelivered": predelivered,
+        # Каждый пользователь должен получить ровно одно сообщение
+        "duplicates": sum(count - 1 for count in telegram.recipients.values() if count > 1),
+        "missed": args.users - predelivered - len(telegram.recipients),
+        "openweather_calls": dict(openweather.calls),
+        "seed_s": round(seed_time, 2),
+        "schedule_load_s": round(load_time, 2),
+        "prefetch_s": round(prefetch_time, 2),
+        "prefetch_openweather_calls": prefetch_calls,
+    })
+
+
+def _user(chat_id: int) -> Dict[str, Any]:
+    return {"id": chat_id, "is_bot": False, "first_name": "Bench"}
+
+
+def synthetic_updates(chat_id: int, city: str, charts: bool, telegram: FakeTelegram) -> Iterator[Dict[str, Any]]:
+    from callbacks import CityCallback, CityRef, WeatherAction, city_key
+    # Типичная сессия: /start, ручной ввод города, прогноз, (график), назад к погоде.
+    # Кнопки нажимаются под последним сообщением бота в этом чате
+    message = {"date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "from": _user(chat_id)}
+
+    def text(value: str) -> Dict[str, Any]:
+        return {"message": {**message, "message_id": random.randint(1, 10 ** 9), "text": value}}
+
+    def callback(data: str) -> Dict[str, Any]:
+        bot_message = {"message_id": telegram.last_message.get(chat_id, 1), "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private"},
+                       "from": {"id": 1, "is_bot": True, "first_name": "bench"}, "text": "..."}
+        return {"callback_query": {"id": str(random.randint(1, 10 ** 9)), "from": _user(chat_id),
+                                   "chat_instance": str(chat_id), "message": bot_message, "data": data}}
+
+    yield text("/start")
+    yield text("🏙 Ввести город")
+    yield text(city)
+    # Ключ совпадает с тем, что бот выдал в клавиатуре под ответом на ввод города
+    key = city_key(CityRef(city))
+    yield callback(CityCallback(action=WeatherAction.FORECAST, key=key).pack())
+    if charts:
+        yield callback(CityCallback(action=WeatherAction.CHART, key=key).pack())
+    yield callback(CityCallback(action=WeatherAction.WEATHER, key=key).pack())
+
+
+async def run_updates(args: argparse.Namespace, telegram: FakeTelegram,
+                      openweather: FakeOpenWeather) -> Dict[str, Any]:
+    from aiogram.types import Update
+    import bot as bot_module
+
+    bot_module.bot.session = make_bot(telegram.url).session
+    rng = random.Random(args.seed)
+    cities = city_names(args.cities)
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    update_id = 0
+
+    async def session(chat_id: int) -> None:
+        nonlocal errors, update_id
+        city, _ = rng.choice(cities)
+        async with semaphore:
+            # Апдейты одного чата идут строго по очереди, как в конвейере вебхука
+            for raw in synthetic_updates(chat_id, city, args.charts, telegram):
+                update_id += 1
+                update = Update.model_validate({"update_id": update_id, **raw})
+                started = time.perf_counter()
+                try:
+                    await bot_module.dp.feed_update(bot_module.bot, update)
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(chat_id) for chat_id in range(1, args.users + 1)))
+    elapsed = time.perf_counter() - started
+
+    if hasattr(bot_module.storage, "flush"):
+        await bot_module.storage.flush()
+    await bot_module.city_keys.close()
+    await bot_module.bot.session.close()
+    return summarize("updates", len(latencies), elapsed, latencies, {
+        "users": args.users,
+        "errors": errors,
+        "openweather_calls": dict(openweather.calls),
+        "telegram_calls": dict(telegram.calls),
+    })
+
+
+async def main(argv: Sequence[str]) -> Dict[str, Any]:
+    args = parse_args(argv)
+    random.seed(args.seed)
+    openweather = FakeOpenWeather(latency=args.latency, error_rate=args.error_rate)
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    await openweather.start()
+    await telegram.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(args, openweather.url, args.db or os.path.join(tmp, "bench.sqlite3"))
+        import charts
+        import database
+        import openweather as openweather_client
+        from tortoise import Tortoise
+
+        await database.setup()
+        if args.tracemalloc:
+            tracemalloc.start()
+        try:
+            if args.scenario == "notifications":
+                result = await run_notifications(args, telegram, openweather)
+            else:
+                result = await run_updates(args, telegram, openweather)
+        finally:
+            await openweather_client.close()
+            charts.close()
+            await Tortoise.close_connections()
+            await telegram.stop()
+            await openweather.stop()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as file:
+            file.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,174 @@
+import asyncio
+import copy
+import json
+import os
+import random
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixture(name: str) -> Dict[str, Any]:
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def city_id_for(name: str) -> int:
+    # Стабильный id для городов, которых нет в фикстуре
+    return zlib.crc32(name.casefold().encode()) % 9_000_000 + 1_000_000
+
+
+class StubServer(ABC):
+    def __init__(self):
+        self.port: Optional[int] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @abstractmethod
+    def create_app(self) -> web.Application:
+        ...
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class FakeOpenWeather(StubServer):
+    # Отдаёт записанные ответы /weather и /forecast (и /group на их основе)
+    # с задержкой latency ± jitter и долей ответов 429
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5, error_rate: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls: Counter = Counter()
+        self._weather = load_fixture("weather.json")
+        self._forecast = load_fixture("forecast.json")
+
+    async def _delay(self) -> Optional[web.Response]:
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            return web.json_response({"cod": 429, "message": "rate limit"}, status=429)
+        return None
+
+    def _current(self, name: Optional[str] = None, city_id: Optional[int] = None,
+                 lat: Optional[str] = None, lon: Optional[str] = None) -> Dict[str, Any]:
+        data = copy.deepcopy(self._weather)
+        data["dt"] = int(time.time())
+        if name:
+            data["name"], data["id"] = name, city_id_for(name)
+        if city_id:
+            data["id"] = city_id
+            data["name"] = f"Город {city_id}" if city_id != self._weather["id"] else data["name"]
+        if lat and lon:
+            data["coord"] = {"lat": float(lat), "lon": float(lon)}
+        return data
+
+    async def handle_weather(self, request: web.Request) -> web.Response:
+        self.calls["weather"] += 1
+        error = await self._delay()
+        if error:
+            return error
+        query = request.query
+        city_id = int(query["id"]) if "id" in query else None
+        return web.json_response(self._current(query.get("q"), city_id, query.get("lat"), query.get("lon")))
+
+    async def handle_group(self, request: web.Request) -> web.Response:
+        self.calls["group"] += 1
+        error = await self._delay()
+        if error:
+            return error
+        ids = [int(city_id) for city_id in request.query["id"].split(",")]
+        items = [self._current(city_id=city_id) for city_id in ids]
+        return web.json_response({"cnt": len(items), "list": items})
+
+    async def handle_forecast(self, request: web.Request) -> web.Response:
+        self.calls["forecast"] += 1
+        error = await self._delay()
+        if error:
+            return error
+        data = copy.deepcopy(self._forecast)
+        name = request.query.get("q")
+        if name:
+            data["city"]["name"], data["city"]["id"] = name, city_id_for(name)
+        return web.json_response(data)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/weather", self.handle_weather)
+        app.router.add_get("/group", self.handle_group)
+        app.router.add_get("/forecast", self.handle_forecast)
+        return app
+
+
+class FakeTelegram(StubServer):
+    # Минимальный Bot API: принимает sendMessage/sendPhoto и сопутствующие методы,
+    # запоминает время прихода каждого сообщения
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.deliveries: List[float] = []
+        # Сколько сообщений получил каждый чат: для проверки рассылки без дублей
+        self.recipients: Counter = Counter()
+        # Последнее текстовое сообщение в чате: на него ссылаются синтетические нажатия кнопок
+        self.last_message: Dict[int, int] = {}
+        self._message_id = 0
+
+    def _message(self, chat_id: int, **fields: Any) -> Dict[str, Any]:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **fields,
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        form = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = int(form.get("chat_id", 0) or 0)
+
+        if method == "sendMessage":
+            self.deliveries.append(time.perf_counter())
+            self.recipients[chat_id] += 1
+            result: Any = self._message(chat_id, text=form.get("text", ""))
+            self.last_message[chat_id] = result["message_id"]
+        elif method in ("sendPhoto", "editMessageMedia"):
+            if method == "sendPhoto":
+                self.deliveries.append(time.perf_counter())
+            file_id = f"photo-{self._message_id}"
+            result = self._message(chat_id, photo=[
+                {"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 400}
+            ])
+        elif method in ("editMessageText", "editMessageCaption"):
+            result = self._message(chat_id, text=form.get("text", ""))
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=20 * 1024 ** 2)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
@@ -3,16 +3,29 @@ import logging
 import re
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.filters import Command, StateFilter
-from aiogram.types import Message, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
-from weather import get_weather, get_weather_by_coords, get_weather_forecast, create_temperature_graph, get_weather_forecast_by_coords
+from config import BOT_TOKEN, BOT_MODE, FSM_STORAGE
+from database.storage import TortoiseStorage
+from fsm import BoundedMemoryStorage
+import charts
+import metrics
+import openweather
+from openweather import OpenWeatherError
+from webhook import run_webhook
+from gazetteer import get_gazetteer
+from upstream import UpstreamUnavailable
+from weather import get_weather, fetch_current_weather, get_location_weather, get_temperature_chart, remember_chart_file_id
 from notifications import send_weather_notifications
+from views import WeatherView, forecast_city, get_view, load_forecast, remember_view, render_forecast, render_weather, view_for
+from callbacks import CityCallback, CityRef, WeatherAction
+from database.city_keys import city_keys
 from database.users import add_user, update_user_city, update_user_notification_time, delete_user_notifications
 from keyboards import get_start_keyboard, get_back_keyboard, get_weather_keyboard, get_forecast_keyboard, get_graph_keyboard, get_main_keyboard
 import datetime
+from typing import Optional
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,7 +38,13 @@ class Status(StatesGroup):
     waiting_manual_city = State()
 
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+if FSM_STORAGE == "database":
+    storage = TortoiseStorage()
+else:
+    storage = BoundedMemoryStorage(default_state=Status.waiting_moment_city.state)
+dp = Dispatcher(storage=storage)
+metrics.setup_dispatcher(dp)
+metrics.register_cache('fsm', storage)
 
 
 @dp.message(Command("start"))
@@ -117,13 +136,20 @@ async def setting_manual_city(message: Message, state: FSMContext):
     StateFilter(Status.waiting_manual_city))
 async def process_manual_city(message: Message, state: FSMContext):
     city = message.text.strip()
+    # Канонизируем написание по справочнику: "питер" и "Санкт-Петербург" попадут в одну запись кэша
+    known_city = get_gazetteer().lookup(city)
+    if known_city:
+        city = known_city.name
 
     try:                                       
         weather_data = await get_weather(city)
-        await message.answer(weather_data, reply_markup=get_weather_keyboard(city))
+        sent = await message.answer(weather_data, reply_markup=get_weather_keyboard(CityRef(city)))
+        remember_view(sent.chat.id, sent.message_id, WeatherView(city=city, weather_text=weather_data))
         await state.clear()
         await state.set_state(Status.waiting_moment_city)
 
+    except UpstreamUnavailable:
+        await message.answer("⏳ Сервис погоды временно недоступен, попробуйте через пару минут")
     except Exception as e:
         await message.answer(f"🚫 Город {city} не найден. Попробуйте еще раз:")
         await state.clear()
@@ -139,17 +165,15 @@ async def handle_location(message: Message, state: FSMContext):
     lon = message.location.longitude      
 
     try:
-        # Сохраняем координаты в состоянии
-        await state.update_data(lat=lat, lon=lon)
-        logger.info(f"Сохранены координаты: lat={lat}, lon={lon}")
-        
-        weather_text = await get_weather_by_coords(lat, lon)
-        # Сохраняем название города из ответа API
-        city_name = weather_text.split('(')[1].split(')')[0]
-        await state.update_data(city_name=city_name)
-        logger.info(f"Сохранено название города: {city_name}")
-        
-        await message.answer(weather_text, reply_markup=get_weather_keyboard("вашем городе"))
+        location = await get_location_weather(lat, lon)
+        # Ячейка сетки едет в ключе кнопки: прогноз возьмется из того же кэша без чтения состояния
+        ref = CityRef(location.city_name, location.lat, location.lon)
+        logger.info(f"Погода по координатам: lat={location.lat}, lon={location.lon}, город: {location.city_name}")
+
+        sent = await message.answer(location.text, reply_markup=get_weather_keyboard(ref))
+        remember_view(sent.chat.id, sent.message_id, WeatherView(
+            city=ref.city, weather_text=location.text, lat=ref.lat, lon=ref.lon
+        ))
         await state.set_state(Status.waiting_moment_city)
     except Exception as e:
         logger.error(f"Ошибка при обработке геолокации: {e}")
@@ -171,10 +195,29 @@ async def cmd_setup(message: Message, state: FSMContext):
 async def process_city(message: Message, state: FSMContext):
     city = message.text
     try:
-        await get_weather(city)                    
-        await state.update_data(city=city)        
-        await update_user_city(                   
-            message.from_user.id, city
+        gazetteer = get_gazetteer()
+        known_city = gazetteer.lookup(city)
+        if known_city:
+            # Город есть в справочнике: запрос к OpenWeather для проверки не нужен
+            city, city_id = known_city.name, known_city.id
+        else:
+            # Справочник неполный: решает OpenWeather, подсказки — только для ненайденных городов
+            try:
+                weather = await fetch_current_weather(city)
+            except OpenWeatherError as e:
+                suggestions = gazetteer.suggest(city) if e.status == 404 else []
+                if not suggestions:
+                    raise
+                await message.answer(
+                    "Возможно, вы имели в виду: "
+                    + ", ".join(suggestion.name for suggestion in suggestions)
+                    + "?\nОтправьте название еще раз."
+                )
+                return
+            city_id = weather.city_id
+        await state.update_data(city=city, city_id=city_id)
+        await update_user_city(
+            message.from_user.id, city, city_id
         )
 
         # Получаем текущее время сервера
@@ -200,7 +243,7 @@ async def process_time(message: Message, state: FSMContext):
 
     data = await state.get_data()                 
     city = data.get('city')
-    await update_user_notification_time(message.from_user.id, time_text)
+    await update_user_notification_time(message.from_user.id, time_text, city, city_id=data.get('city_id'))
     await message.answer(
         f"Настройка завершена! Вы будете получать прогноз погоды для города {city} каждый день в {time_text}.\n\n",
         reply_markup=get_start_keyboard())
@@ -225,37 +268,43 @@ async def cmd_delete_notifications(message: Message, state: FSMContext):
         await state.set_state(Status.waiting_moment_city)
 
 
-@dp.callback_query(lambda c: c.data.startswith('forecast_'))
-async def process_forecast_callback(callback_query: types.CallbackQuery, state: FSMContext):
-    city = callback_query.data.split('_')[1]
+async def edit_view(message: Message, text: str, reply_markup: InlineKeyboardMarkup) -> None:
+    # Навигация правит сообщение на месте: один запрос к Telegram вместо удаления и повторной отправки
     try:
-        if city == "вашем городе":
-            # Получаем данные из состояния
-            data = await state.get_data()
-            lat = data.get('lat')
-            lon = data.get('lon')
-            city_name = data.get('city_name')
-            
-            logger.info(f"Получены данные из состояния: lat={lat}, lon={lon}, city_name={city_name}")
-            
-            if lat and lon:
-                forecast = await get_weather_forecast_by_coords(lat, lon)
-                # Обновляем клавиатуру с правильным названием города
-                keyboard = get_forecast_keyboard(city_name)
-            else:
-                raise Exception("Не удалось получить координаты")
-        else:
-            forecast = await get_weather_forecast(city)
-            keyboard = get_forecast_keyboard(city)
-            
-        # Удаляем предыдущее сообщение
-        await callback_query.message.delete()
-        # Отправляем новое сообщение с прогнозом
-        await bot.send_message(
-            chat_id=callback_query.from_user.id,
-            text=forecast,
-            reply_markup=keyboard
-        )
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        # Повторное нажатие той же кнопки
+        if "message is not modified" not in str(e):
+            raise
+
+
+async def resolve_city(callback_query: types.CallbackQuery, callback_data: CityCallback) -> Optional[CityRef]:
+    ref = await city_keys.resolve(callback_data.key)
+    if ref is None:
+        await callback_query.answer("Кнопка устарела, запросите погоду заново", show_alert=True)
+    return ref
+
+
+@dp.callback_query(CityCallback.filter(F.action == WeatherAction.FORECAST))
+async def process_forecast_callback(callback_query: types.CallbackQuery, callback_data: CityCallback):
+    message = callback_query.message
+    try:
+        if message.photo:
+            # "Назад к прогнозу" под графиком: сообщение с прогнозом осталось выше, убираем только график
+            await message.delete()
+            return
+
+        view = get_view(message.chat.id, message.message_id)
+        if view is None:
+            # Снимка нет (перезапуск или вытеснение) — собираем заново по ключу кнопки
+            ref = await resolve_city(callback_query, callback_data)
+            if ref is None:
+                return
+            view = view_for(ref)
+            remember_view(message.chat.id, message.message_id, view)
+
+        forecast = await render_forecast(view)
+        await edit_view(message, forecast, get_forecast_keyboard(CityRef(view.city, view.lat, view.lon)))
     except Exception as e:
         logger.error(f"Ошибка при получении прогноза: {e}")
         await bot.send_message(
@@ -265,42 +314,52 @@ async def process_forecast_callback(callback_query: types.CallbackQuery, state:
         )
 
 
-@dp.callback_query(lambda c: c.data.startswith('detailed_forecast_'))
-async def process_detailed_forecast_callback(callback_query: types.CallbackQuery):
-    city = callback_query.data.split('_')[2]
+@dp.callback_query(CityCallback.filter(F.action == WeatherAction.CHART))
+async def process_detailed_forecast_callback(callback_query: types.CallbackQuery, callback_data: CityCallback):
+    message = callback_query.message
+    ref = await resolve_city(callback_query, callback_data)
+    if ref is None:
+        return
     try:
-        # Создаем график
-        graph_bytes = await create_temperature_graph(city)
-        
-        # Удаляем предыдущее сообщение
-        await callback_query.message.delete()
-        
-        # Отправляем график как фото
-        await callback_query.message.answer_photo(
-            photo=types.BufferedInputFile(graph_bytes, filename="temperature_graph.png"),
+        # График строится по тому же снимку прогноза, что и сообщение; готовый берется из кэша
+        view = get_view(message.chat.id, message.message_id) or view_for(ref)
+        forecast = await load_forecast(view)
+        city = forecast_city(view)
+        chart = await get_temperature_chart(city, forecast)
+        # Уже загруженный в Telegram график отправляем по file_id
+        photo = chart.file_id or types.BufferedInputFile(chart.png, filename="temperature_graph.png")
+
+        # Фото нельзя получить правкой текстового сообщения, поэтому график
+        # отправляется отдельно, а прогноз остается на месте для кнопки "назад"
+        sent = await message.answer_photo(
+            photo=photo,
             caption=f"📊 График температуры в городе {city}",
-            reply_markup=get_graph_keyboard(city)
+            reply_markup=get_graph_keyboard(ref)
         )
+        if not chart.file_id:
+            remember_chart_file_id(chart, sent.photo[-1].file_id)
     except Exception as e:
-        await callback_query.message.edit_text(
+        logger.error(f"Ошибка при построении графика: {e}")
+        await message.edit_text(
             text=f"Не удалось создать график: {str(e)}",
-            reply_markup=get_forecast_keyboard(city)
+            reply_markup=get_forecast_keyboard(ref)
         )
 
 
-@dp.callback_query(lambda c: c.data.startswith('back_to_weather_'))
-async def process_back_to_weather_callback(callback_query: types.CallbackQuery):
-    city = callback_query.data.split('_')[3]
+@dp.callback_query(CityCallback.filter(F.action == WeatherAction.WEATHER))
+async def process_back_to_weather_callback(callback_query: types.CallbackQuery, callback_data: CityCallback):
+    message = callback_query.message
     try:
-        weather_data = await get_weather(city)
-        # Удаляем предыдущее сообщение
-        await callback_query.message.delete()
-        # Отправляем новое сообщение с погодой
-        await bot.send_message(
-            chat_id=callback_query.from_user.id,
-            text=weather_data,
-            reply_markup=get_weather_keyboard(city)
-        )
+        view = get_view(message.chat.id, message.message_id)
+        if view is None:
+            ref = await resolve_city(callback_query, callback_data)
+            if ref is None:
+                return
+            view = view_for(ref)
+            remember_view(message.chat.id, message.message_id, view)
+        # Погода перерисовывается из снимка, по которому было построено сообщение
+        weather_data = await render_weather(view)
+        await edit_view(message, weather_data, get_weather_keyboard(CityRef(view.city, view.lat, view.lon)))
     except Exception as e:
         await bot.send_message(
             chat_id=callback_query.from_user.id,
@@ -309,9 +368,27 @@ async def process_back_to_weather_callback(callback_query: types.CallbackQuery):
         )
 
 
+@dp.callback_query(F.data.startswith(('forecast_', 'detailed_forecast_', 'back_to_weather_')))
+async def process_legacy_city_callback(callback_query: types.CallbackQuery):
+    # Кнопки старого формата с названием города в callback_data больше не разбираем
+    await callback_query.answer("Кнопка устарела, запросите погоду заново", show_alert=True)
+
+
 async def setup():
-    asyncio.create_task(send_weather_notifications(bot))
-    await dp.start_polling(bot)
+    await openweather.setup()
+    metrics_runner = await metrics.start_server()
+    try:
+        asyncio.create_task(send_weather_notifications(bot))
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await city_keys.close()
+        await openweather.close()
+        charts.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Сколько просроченная запись ещё хранится на случай недоступности источника
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, _, value = item
+        now = time.monotonic()
+        if expires_at <= now:
+            if expires_at + self.stale_ttl <= now:
+                del self._data[key]
+            self.misses += 1
+            return default
+        # Свежая запись поднимается в конец очереди LRU
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self._data[key] = (now + (self.ttl if ttl is None else ttl), now, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[2]
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        # Запись в пределах stale_ttl, даже если её TTL уже истёк; статистику не трогает
+        item = self._data.get(key)
+        if item is None or item[0] + self.stale_ttl <= time.monotonic():
+            return default
+        return item[2]
+
+    def ttl_left(self, key: Hashable) -> float:
+        # Сколько секунд запись ещё будет свежей; 0 — записи нет или она просрочена
+        item = self._data.get(key)
+        return max(item[0] - time.monotonic(), 0.0) if item is not None else 0.0
+
+    def stale_age(self, key: Hashable) -> Optional[float]:
+        # Возраст записи в секундах, если она просрочена, иначе None
+        item = self._data.get(key)
+        if item is None:
+            return None
+        now = time.monotonic()
+        return now - item[1] if item[0] <= now else None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+class SingleFlight:
+    def __init__(self):
+        self.shared = 0
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Помечаем исключение полученным, даже если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
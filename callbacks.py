@@ -0,0 +1,31 @@
+import base64
+import hashlib
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+from aiogram.filters.callback_data import CallbackData
+
+
+class WeatherAction(str, Enum):
+    WEATHER = 'w'
+    FORECAST = 'f'
+    CHART = 'c'
+
+
+class CityCallback(CallbackData, prefix='city'):
+    # "city:f:Ab3dE_9x" — укладывается в 64 байта при любом названии города
+    action: WeatherAction
+    key: str
+
+
+@dataclass(frozen=True, slots=True)
+class CityRef:
+    city: str
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+
+
+def city_key(ref: CityRef) -> str:
+    # Ключ детерминирован: одинаковый город получает одинаковый ключ в любом процессе
+    raw = f"{ref.city}|{ref.lat}|{ref.lon}".encode()
+    return base64.urlsafe_b64encode(hashlib.blake2b(raw, digest_size=6).digest()).decode()
@@ -0,0 +1,85 @@
+import asyncio
+import io
+import logging
+from contextlib import suppress
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+from config import CHART_EXECUTOR, CHART_WORKERS, CHART_QUEUE_SIZE, CHART_TIMEOUT
+from metrics import chart_render_duration
+
+logger = logging.getLogger(__name__)
+
+
+class ChartQueueFullError(Exception):
+    pass
+
+
+_executor: Optional[Executor] = None
+_pending = 0
+
+
+def _render_temperature_chart(title: str, times: List[datetime], temps: List[float]) -> bytes:
+    # matplotlib импортируется только при первой отрисовке и без pyplot:
+    # объектный API не держит глобального состояния и безопасен в потоках
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(12, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(times, temps, marker='o')
+    ax.set_title(title)
+    ax.set_xlabel('Время')
+    ax.set_ylabel('Температура (°C)')
+    ax.grid(True)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if CHART_EXECUTOR == 'process':
+            _executor = ProcessPoolExecutor(max_workers=CHART_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=CHART_WORKERS, thread_name_prefix='chart')
+        logger.info(f"Пул отрисовки графиков: {CHART_EXECUTOR}, воркеров {CHART_WORKERS}")
+    return _executor
+
+
+def _release() -> None:
+    global _pending
+    _pending -= 1
+
+
+def _release_from(loop: asyncio.AbstractEventLoop) -> None:
+    # Вызывается в потоке пула; цикл событий к этому моменту может быть уже закрыт
+    with suppress(RuntimeError):
+        loop.call_soon_threadsafe(_release)
+
+
+async def render_temperature_chart(city: str, times: List[datetime], temps: List[float]) -> bytes:
+    global _pending
+    if _pending >= CHART_QUEUE_SIZE:
+        raise ChartQueueFullError("Слишком много запросов на графики, попробуйте чуть позже")
+
+    loop = asyncio.get_running_loop()
+    job = get_executor().submit(_render_temperature_chart, f'Прогноз температуры в городе {city}', times, temps)
+    # Место в очереди освобождает сама задача пула, а не ожидающий: после таймаута отрисовка
+    # продолжает занимать воркер, и без этого очередь пула росла бы без ограничений
+    _pending += 1
+    job.add_done_callback(lambda _: _release_from(loop))
+    with chart_render_duration.time():
+        return await asyncio.wait_for(asyncio.wrap_future(job), CHART_TIMEOUT)
+
+
+def close() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,8 +8,120 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
 POSTGRES_URI = os.getenv("POSTGRES_URI")
 
-OPENWEATHER_API_URL = "https://api.openweathermap.org/data/2.5/weather"
-OPENWEATHER_FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast"
+# Базовый адрес можно переопределить, например на локальную заглушку
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org/data/2.5")
+OPENWEATHER_API_URL = f"{OPENWEATHER_BASE_URL}/weather"
+OPENWEATHER_FORECAST_URL = f"{OPENWEATHER_BASE_URL}/forecast"
+OPENWEATHER_GROUP_URL = f"{OPENWEATHER_BASE_URL}/group"
+OPENWEATHER_GROUP_LIMIT = 20  # Максимум id в одном запросе /group
+
+# Режим получения апдейтов: "polling" или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# Пул соединений к OpenWeather
+OPENWEATHER_POOL_SIZE = int(os.getenv("OPENWEATHER_POOL_SIZE", "20"))
+OPENWEATHER_CONCURRENCY = int(os.getenv("OPENWEATHER_CONCURRENCY", "10"))
+OPENWEATHER_TIMEOUT = float(os.getenv("OPENWEATHER_TIMEOUT", "10"))
+OPENWEATHER_DNS_TTL = int(os.getenv("OPENWEATHER_DNS_TTL", "300"))
+OPENWEATHER_KEEPALIVE = float(os.getenv("OPENWEATHER_KEEPALIVE", "30"))
+
+# Защита от перегрузки OpenWeather: квота тарифа, резерв для интерактивных запросов,
+# повторы с джиттером и автомат-предохранитель
+OPENWEATHER_CALLS_PER_MINUTE = float(os.getenv("OPENWEATHER_CALLS_PER_MINUTE", "60"))
+OPENWEATHER_BURST = float(os.getenv("OPENWEATHER_BURST", "10"))
+OPENWEATHER_INTERACTIVE_RESERVE = float(os.getenv("OPENWEATHER_INTERACTIVE_RESERVE", "3"))
+OPENWEATHER_INTERACTIVE_WAIT = float(os.getenv("OPENWEATHER_INTERACTIVE_WAIT", "2"))
+OPENWEATHER_SCHEDULED_WAIT = float(os.getenv("OPENWEATHER_SCHEDULED_WAIT", "60"))
+OPENWEATHER_RETRIES = int(os.getenv("OPENWEATHER_RETRIES", "2"))
+OPENWEATHER_BACKOFF = float(os.getenv("OPENWEATHER_BACKOFF", "0.5"))
+OPENWEATHER_BACKOFF_MAX = float(os.getenv("OPENWEATHER_BACKOFF_MAX", "8"))
+OPENWEATHER_BREAKER_THRESHOLD = int(os.getenv("OPENWEATHER_BREAKER_THRESHOLD", "5"))
+OPENWEATHER_BREAKER_RESET = float(os.getenv("OPENWEATHER_BREAKER_RESET", "30"))
+# Сколько просроченные данные можно показывать, пока OpenWeather недоступен
+OPENWEATHER_STALE_TTL = float(os.getenv("OPENWEATHER_STALE_TTL", "21600"))
+
+# Кэш текущей погоды (OpenWeather обновляет данные примерно раз в 10 минут)
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1000"))
+FORECAST_CACHE_TTL = float(os.getenv("FORECAST_CACHE_TTL", "1800"))
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", "500"))
+
+# Геолокация округляется до ячейки сетки (0.05° ≈ 5 км), соседи делят один запрос
+LOCATION_GRID_STEP = float(os.getenv("LOCATION_GRID_STEP", "0.05"))
+LOCATION_CACHE_TTL = float(os.getenv("LOCATION_CACHE_TTL", "600"))
+LOCATION_CACHE_SIZE = int(os.getenv("LOCATION_CACHE_SIZE", "2000"))
+
+# Офлайн-справочник городов: data/cities.tsv или выгрузка GeoNames (cities15000.txt)
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cities.tsv"))
+
+# Эндпоинт /metrics в формате Prometheus (порт 0 — не запускать)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Хранилище FSM: "database" переживает перезапуски и общее для нескольких реплик, "memory" — только в процессе
+FSM_STORAGE = os.getenv("FSM_STORAGE", "database")
+# Маршрутизация апдейтов между репликами для хранилища "database":
+# "sticky" — один процесс (polling всегда такой) или чат закреплен за репликой, тогда работают
+# локальный кэш и отложенная запись (FSM_CACHE_TTL, FSM_FLUSH_INTERVAL);
+# "shared" — вебхук за балансировщиком, чат может попасть в любую реплику, поэтому
+# состояние читается и пишется сразу в БД ценой запроса на каждый апдейт
+FSM_ROUTING = os.getenv("FSM_ROUTING", "sticky")
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "5"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+# Ограничения хранилища "memory": число записей и время простоя до вытеснения
+FSM_MAX_ENTRIES = int(os.getenv("FSM_MAX_ENTRIES", "100000"))
+FSM_IDLE_TTL = float(os.getenv("FSM_IDLE_TTL", "86400"))
+
+# Сколько пропущенных минут рассылки досылать после задержки; после перезапуска —
+# только в режиме NOTIFICATION_COORDINATION="database", где доставки записываются в БД
+NOTIFICATION_CATCHUP_MINUTES = int(os.getenv("NOTIFICATION_CATCHUP_MINUTES", "15"))
+NOTIFICATION_SEND_CONCURRENCY = int(os.getenv("NOTIFICATION_SEND_CONCURRENCY", "50"))
+NOTIFICATION_SEND_RETRIES = int(os.getenv("NOTIFICATION_SEND_RETRIES", "3"))
+# За сколько минут до слота прогревать кэш погоды для его городов (0 — не прогревать)
+NOTIFICATION_PREFETCH_MINUTES = int(os.getenv("NOTIFICATION_PREFETCH_MINUTES", "5"))
+# Рассылка с нескольких реплик: "database" — слот делится на шарды, которые процессы
+# разбирают через аренды в БД; "local" — единственный процесс шлет все сам
+NOTIFICATION_COORDINATION = os.getenv("NOTIFICATION_COORDINATION", "database")
+# Число шардов должно совпадать на всех репликах
+NOTIFICATION_SHARDS = int(os.getenv("NOTIFICATION_SHARDS", "16"))
+# Аренда продлевается во время рассылки; брошенный шард подхватывается после истечения
+NOTIFICATION_LEASE_TTL = float(os.getenv("NOTIFICATION_LEASE_TTL", "60"))
+NOTIFICATION_DELIVERY_FLUSH_INTERVAL = float(os.getenv("NOTIFICATION_DELIVERY_FLUSH_INTERVAL", "1"))
+# Сколько хранить аренды и отметки о доставке
+NOTIFICATION_HISTORY_MINUTES = int(os.getenv("NOTIFICATION_HISTORY_MINUTES", "2880"))
+NOTIFICATION_WORKER_ID = os.getenv("NOTIFICATION_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# Отрисовка графиков: "thread" или "process"
+CHART_EXECUTOR = os.getenv("CHART_EXECUTOR", "thread")
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+CHART_QUEUE_SIZE = int(os.getenv("CHART_QUEUE_SIZE", "20"))
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", "15"))
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "200"))
+CHART_CACHE_TTL = float(os.getenv("CHART_CACHE_TTL", "10800"))
+
+# Снимки данных, из которых построены сообщения с погодой: по ним кнопки навигации
+# перерисовывают сообщение без запросов к OpenWeather
+VIEW_CACHE_SIZE = int(os.getenv("VIEW_CACHE_SIZE", "50000"))
+# Не дольше кэша прогноза: снимок не держит в памяти прогноз, который кэш уже выбросил.
+# Кнопки под более старыми сообщениями собирают снимок заново по ключу города
+VIEW_CACHE_TTL = float(os.getenv("VIEW_CACHE_TTL", str(FORECAST_CACHE_TTL)))
+
+# Короткие ключи городов в callback_data: горячие держатся в памяти, все — в таблице city_keys
+CITY_KEY_CACHE_SIZE = int(os.getenv("CITY_KEY_CACHE_SIZE", "10000"))
+CITY_KEY_CACHE_TTL = float(os.getenv("CITY_KEY_CACHE_TTL", "86400"))
+CITY_KEY_FLUSH_INTERVAL = float(os.getenv("CITY_KEY_FLUSH_INTERVAL", "1"))
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду на чат
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1"))
 
 print(POSTGRES_URI, BOT_TOKEN, OPENWEATHER_API_KEY)
 if not BOT_TOKEN:
@@ -1,5 +1,6 @@
 from tortoise import Tortoise 
 from config import POSTGRES_URI
+from database.migrations import migrate
 
 TORTOISE_ORM = {
     "connections": {
@@ -16,4 +17,5 @@ TORTOISE_ORM = {
 
 async def setup():
     await Tortoise.init(config=TORTOISE_ORM)
-    await Tortoise.generate_schemas()
\ No newline at end of file
+    await Tortoise.generate_schemas()
+    await migrate()
@@ -0,0 +1,61 @@
+import logging
+from typing import Dict, Optional
+from cache import TTLCache
+from callbacks import CityRef, city_key
+from config import CITY_KEY_CACHE_SIZE, CITY_KEY_CACHE_TTL, CITY_KEY_FLUSH_INTERVAL
+from database.models import CityKey
+from database.write_behind import WriteBehindBuffer
+from metrics import db_query_duration, register_cache
+
+logger = logging.getLogger(__name__)
+
+
+class CityKeyRegistry:
+    # Новые ключи копятся в буфере и пишутся в БД пачкой раз в flush_interval;
+    # ключ из старой кнопки, вытесненный из памяти или выданный другой репликой, ищется в БД
+    def __init__(
+        self,
+        cache_size: int = CITY_KEY_CACHE_SIZE,
+        cache_ttl: float = CITY_KEY_CACHE_TTL,
+        flush_interval: float = CITY_KEY_FLUSH_INTERVAL,
+    ):
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._pending = WriteBehindBuffer(self._write, flush_interval, "ключей городов")
+
+    def intern(self, ref: CityRef) -> str:
+        key = city_key(ref)
+        if key not in self._cache:
+            self._pending.put(key, ref)
+        self._cache.set(key, ref)
+        return key
+
+    async def resolve(self, key: str) -> Optional[CityRef]:
+        ref = self._cache.get(key) or self._pending.get(key)
+        if ref is None:
+            with db_query_duration.time(query='city_key_load'):
+                row = await CityKey.filter(key=key).first()
+            if row is None:
+                return None
+            ref = CityRef(city=row.city, lat=row.lat, lon=row.lon)
+            self._cache.set(key, ref)
+        return ref
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._cache.stats(), 'pending': len(self._pending)}
+
+    async def flush(self) -> None:
+        await self._pending.flush()
+
+    async def close(self) -> None:
+        await self._pending.close()
+
+    async def _write(self, batch: Dict[str, CityRef]) -> None:
+        with db_query_duration.time(query='city_key_flush'):
+            await CityKey.bulk_create(
+                [CityKey(key=key, city=ref.city, lat=ref.lat, lon=ref.lon) for key, ref in batch.items()],
+                ignore_conflicts=True,
+            )
+
+
+city_keys = CityKeyRegistry()
+register_cache('city_keys', city_keys)
@@ -0,0 +1,97 @@
+import logging
+import time
+from typing import List, Optional, Set, Tuple
+from tortoise.expressions import RawSQL
+from database.models import NotificationDelivery, NotificationLease, Users
+from metrics import db_query_duration, timed
+
+logger = logging.getLogger(__name__)
+
+
+@timed(db_query_duration, query='has_due_users')
+async def has_due_users(utc_minute: int) -> bool:
+    # Большинство минут суток пустые: для них не заводим ни аренд, ни запросов по шардам
+    return await Users.filter(notification_utc_minute=utc_minute, notifications_enabled=True).exists()
+
+
+@timed(db_query_duration, query='create_slot_leases')
+async def create_slot_leases(slot: int, shards: int) -> None:
+    # Строки шардов создает первый добравшийся до слота процесс, остальные наткнутся на конфликт
+    await NotificationLease.bulk_create(
+        [NotificationLease(slot=slot, shard=shard) for shard in range(shards)],
+        ignore_conflicts=True
+    )
+
+
+@timed(db_query_duration, query='claim_lease')
+async def claim_lease(slot: int, shard: int, owner: str, ttl: float) -> bool:
+    # Условный UPDATE атомарен: из нескольких процессов шард получит ровно один
+    now = time.time()
+    updated = await NotificationLease.filter(
+        slot=slot, shard=shard, done=False, expires_at__lt=now
+    ).update(owner=owner, expires_at=now + ttl)
+    return bool(updated)
+
+
+@timed(db_query_duration, query='claim_prefetch')
+async def claim_prefetch(slot: int, shard: int, owner: str) -> bool:
+    # Погоду для шарда прогревает один процесс, он же первым берется за его рассылку
+    updated = await NotificationLease.filter(
+        slot=slot, shard=shard, prefetched_by__isnull=True
+    ).update(prefetched_by=owner)
+    return bool(updated)
+
+
+@timed(db_query_duration, query='renew_lease')
+async def renew_lease(slot: int, shard: int, owner: str, ttl: float) -> bool:
+    updated = await NotificationLease.filter(
+        slot=slot, shard=shard, owner=owner, done=False
+    ).update(expires_at=time.time() + ttl)
+    return bool(updated)
+
+
+@timed(db_query_duration, query='complete_lease')
+async def complete_lease(slot: int, shard: int, owner: str) -> bool:
+    updated = await NotificationLease.filter(slot=slot, shard=shard, owner=owner).update(done=True)
+    return bool(updated)
+
+
+@timed(db_query_duration, query='get_abandoned_leases')
+async def get_abandoned_leases(since_slot: int, before_slot: int) -> List[Tuple[int, int]]:
+    # Незавершенные шарды прошлых слотов, чья аренда истекла или так и не была взята
+    return await NotificationLease.filter(
+        slot__gte=since_slot, slot__lt=before_slot, done=False, expires_at__lt=time.time()
+    ).order_by('slot', 'shard').values_list('slot', 'shard')
+
+
+@timed(db_query_duration, query='get_shard_users')
+async def get_shard_users(utc_minute: int, shards: int, shard: int) -> List[Tuple[int, Optional[str], Optional[int]]]:
+    # Расписание читается из БД, а не из памяти: время могли поменять через другую реплику.
+    # Условие по минуте попадает в users_notification_slot_idx, остаток по модулю считается по найденным строкам
+    return await Users.annotate(
+        shard=RawSQL(f"telegram_id % {int(shards)}")
+    ).filter(
+        notification_utc_minute=utc_minute, notifications_enabled=True, shard=shard
+    ).values_list('telegram_id', 'city', 'city_id')
+
+
+@timed(db_query_duration, query='get_delivered')
+async def get_delivered(slot: int, shard: int) -> Set[int]:
+    return set(await NotificationDelivery.filter(slot=slot, shard=shard).values_list('telegram_id', flat=True))
+
+
+@timed(db_query_duration, query='record_deliveries')
+async def record_deliveries(slot: int, shard: int, telegram_ids: List[int]) -> None:
+    await NotificationDelivery.bulk_create(
+        [NotificationDelivery(slot=slot, shard=shard, telegram_id=telegram_id) for telegram_id in telegram_ids],
+        ignore_conflicts=True
+    )
+
+
+@timed(db_query_duration, query='purge_notification_history')
+async def purge_notification_history(before_slot: int) -> None:
+    try:
+        await NotificationDelivery.filter(slot__lt=before_slot).delete()
+        await NotificationLease.filter(slot__lt=before_slot).delete()
+    except Exception as e:
+        logger.error(f"Ошибка при очистке истории рассылки: {e}")
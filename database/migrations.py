@@ -0,0 +1,68 @@
+import logging
+from typing import Set
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from scheduler import local_utc_offset_minutes
+
+logger = logging.getLogger(__name__)
+
+
+async def _get_columns(conn: BaseDBAsyncClient, table: str) -> Set[str]:
+    if conn.capabilities.dialect == "sqlite":
+        rows = await conn.execute_query_dict(f"PRAGMA table_info({table})")
+        return {row['name'] for row in rows}
+    rows = await conn.execute_query_dict(
+        f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table}'"
+    )
+    return {row['column_name'] for row in rows}
+
+
+async def migrate_notification_minutes(conn: BaseDBAsyncClient) -> None:
+    # "HH:MM" в notification_time -> минута суток + минута в UTC с частичным индексом
+    columns = await _get_columns(conn, 'users')
+    if 'notification_minute' not in columns:
+        await conn.execute_script("ALTER TABLE users ADD COLUMN notification_minute SMALLINT")
+    if 'notification_utc_minute' not in columns:
+        await conn.execute_script("ALTER TABLE users ADD COLUMN notification_utc_minute SMALLINT")
+    if 'timezone' not in columns:
+        await conn.execute_script("ALTER TABLE users ADD COLUMN timezone VARCHAR(64)")
+
+    if 'notification_time' in columns:
+        # Старые значения заданы во времени сервера
+        offset = local_utc_offset_minutes()
+        await conn.execute_script(
+            "UPDATE users SET notification_minute = "
+            "CAST(substr(notification_time, 1, 2) AS INTEGER) * 60 + CAST(substr(notification_time, 4, 2) AS INTEGER) "
+            "WHERE notification_time IS NOT NULL AND notification_minute IS NULL"
+        )
+        await conn.execute_script(
+            f"UPDATE users SET notification_utc_minute = ((notification_minute - {offset}) % 1440 + 1440) % 1440 "
+            "WHERE notification_minute IS NOT NULL AND notification_utc_minute IS NULL"
+        )
+        await conn.execute_script("ALTER TABLE users DROP COLUMN notification_time")
+        logger.info("Время уведомлений перенесено в notification_minute / notification_utc_minute")
+
+    await conn.execute_script(
+        "CREATE INDEX IF NOT EXISTS users_notification_slot_idx "
+        "ON users (notification_utc_minute) WHERE notifications_enabled"
+    )
+
+
+async def migrate_city_id(conn: BaseDBAsyncClient) -> None:
+    # Заполняется постепенно: при смене города и при первой рассылке по имени
+    columns = await _get_columns(conn, 'users')
+    if 'city_id' not in columns:
+        await conn.execute_script("ALTER TABLE users ADD COLUMN city_id INT")
+
+
+async def migrate_notification_leases(conn: BaseDBAsyncClient) -> None:
+    columns = await _get_columns(conn, 'notification_leases')
+    if 'prefetched_by' not in columns:
+        await conn.execute_script("ALTER TABLE notification_leases ADD COLUMN prefetched_by VARCHAR(255)")
+
+
+async def migrate() -> None:
+    conn = Tortoise.get_connection("default")
+    await migrate_notification_minutes(conn)
+    await migrate_city_id(conn)
+    await migrate_notification_leases(conn)
@@ -8,9 +8,63 @@ class Users(Model):
     first_name = fields.CharField(max_length=255, null=True)
     last_name = fields.CharField(max_length=255, null=True)
     city = fields.CharField(max_length=255, null=True)
-    notification_time = fields.CharField(max_length=5, null=True)  # Формат "HH:MM"
+    city_id = fields.IntField(null=True)  # id города в OpenWeather
+    notification_minute = fields.SmallIntField(null=True)  # Минута суток по времени пользователя
+    notification_utc_minute = fields.SmallIntField(null=True)  # Та же минута в UTC, по ней идёт рассылка
+    timezone = fields.CharField(max_length=64, null=True)  # IANA, например "Europe/Moscow"; None — время сервера
     notifications_enabled = fields.BooleanField(default=False)
 
     class Meta:
         table = "users"
         app = "models_users"
+
+
+class CityKey(Model):
+    # Короткий ключ из callback_data -> город или ячейка геолокации
+    key = fields.CharField(max_length=16, pk=True)
+    city = fields.CharField(max_length=255)
+    lat = fields.FloatField(null=True)
+    lon = fields.FloatField(null=True)
+
+    class Meta:
+        table = "city_keys"
+        app = "models_users"
+
+
+class NotificationLease(Model):
+    # Аренда шарда слота рассылки: кто его рассылает и до какого момента (unix time)
+    id = fields.IntField(pk=True)
+    slot = fields.BigIntField()  # Минута UTC от начала эпохи
+    shard = fields.SmallIntField()
+    owner = fields.CharField(max_length=255, null=True)
+    prefetched_by = fields.CharField(max_length=255, null=True)  # Кто прогревает погоду для шарда
+    expires_at = fields.FloatField(default=0)
+    done = fields.BooleanField(default=False)
+
+    class Meta:
+        table = "notification_leases"
+        app = "models_users"
+        unique_together = (("slot", "shard"),)
+
+
+class NotificationDelivery(Model):
+    # Отметка об отправленном уведомлении: новый владелец шарда не шлет его повторно
+    id = fields.BigIntField(pk=True)
+    slot = fields.BigIntField()
+    shard = fields.SmallIntField()
+    telegram_id = fields.BigIntField()
+
+    class Meta:
+        table = "notification_deliveries"
+        app = "models_users"
+        unique_together = (("slot", "shard", "telegram_id"),)
+
+
+class FSMRecord(Model):
+    key = fields.CharField(max_length=255, pk=True)
+    state = fields.CharField(max_length=255, null=True)
+    data = fields.JSONField(default=dict)
+
+    class Meta:
+        table = "fsm_states"
+        app = "models_users"
@@ -0,0 +1,92 @@
+import logging
+from typing import Any, Dict, Mapping, Optional, Tuple
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from cache import TTLCache
+from config import FSM_FLUSH_INTERVAL, FSM_CACHE_TTL, FSM_CACHE_SIZE, FSM_ROUTING
+from database.models import FSMRecord
+from database.write_behind import WriteBehindBuffer
+from metrics import db_query_duration
+
+logger = logging.getLogger(__name__)
+
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+class TortoiseStorage(BaseStorage):
+    # В режиме "sticky" запись идёт через буфер, который сбрасывается в БД раз в flush_interval,
+    # чтение — через локальный кэш. Кэш ничего не знает о записях соседних процессов,
+    # поэтому в режиме "shared" оба слоя выключены и каждое обращение идёт в БД.
+    def __init__(
+        self,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        cache_ttl: float = FSM_CACHE_TTL,
+        cache_size: int = FSM_CACHE_SIZE,
+        key_builder: Optional[KeyBuilder] = None,
+        routing: str = FSM_ROUTING,
+    ):
+        self.shared = routing == "shared"
+        self._key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._dirty = WriteBehindBuffer(self._write, flush_interval, "состояний FSM")
+
+    async def _load(self, key: str) -> Record:
+        record = self._dirty.get(key) or (None if self.shared else self._cache.get(key))
+        if record is None:
+            with db_query_duration.time(query='fsm_load'):
+                row = await FSMRecord.filter(key=key).first()
+            record = (row.state, row.data) if row else (None, {})
+            if not self.shared:
+                self._cache.set(key, record)
+        return record
+
+    async def _store(self, key: str, record: Record) -> None:
+        if self.shared:
+            state, data = record
+            with db_query_duration.time(query='fsm_store'):
+                await FSMRecord.bulk_create(
+                    [FSMRecord(key=key, state=state, data=data)],
+                    on_conflict=['key'],
+                    update_fields=['state', 'data'],
+                )
+            return
+        self._dirty.put(key, record)
+        self._cache.set(key, record)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key_builder.build(key)
+        _, data = await self._load(storage_key)
+        await self._store(storage_key, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        storage_key = self._key_builder.build(key)
+        state, _ = await self._load(storage_key)
+        await self._store(storage_key, (state, data.copy()))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self._key_builder.build(key))
+        return data.copy()
+
+    async def flush(self) -> None:
+        await self._dirty.flush()
+
+    async def _write(self, batch: Dict[str, Record]) -> None:
+        with db_query_duration.time(query='fsm_flush'):
+            await FSMRecord.bulk_create(
+                [FSMRecord(key=key, state=state, data=data) for key, (state, data) in batch.items()],
+                on_conflict=['key'],
+                update_fields=['state', 'data'],
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), 'dirty': len(self._dirty)}
+
+    async def close(self) -> None:
+        await self._dirty.close()
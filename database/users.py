@@ -1,9 +1,15 @@
 import logging
-from typing import List, Optional, Tuple, Dict, Any
+from typing import List, Optional, Tuple, Dict, Any, Iterable
 from database.models import Users
+from metrics import db_query_duration, timed
+from scheduler import MINUTES_PER_DAY, local_utc_offset_minutes, schedule, time_to_minute, to_utc_minute
 
 logger = logging.getLogger(__name__)
 
+# Смещение от UTC, по которому посчитаны notification_utc_minute, для каждой зоны (None — время сервера)
+_offsets: Dict[Optional[str], int] = {}
+
+@timed(db_query_duration, query='get_user_by_telegram_id')
 async def get_user_by_telegram_id(telegram_id: int) -> Optional[Users]:
     try:
         user = await Users.filter(telegram_id=telegram_id).first()
@@ -12,72 +18,190 @@ async def get_user_by_telegram_id(telegram_id: int) -> Optional[Users]:
         logger.error(f"Ошибка при поиске пользователя {telegram_id}: {e}")
         return None
 
+@timed(db_query_duration, query='add_user')
 async def add_user(user_id: int, username: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> None:
     try:
-        existing_user = await get_user_by_telegram_id(user_id)
-        
-        if existing_user:
-            logger.info(f"Пользователь {user_id} уже существует в базе данных")
-            return
-            
-        new_users = Users(
-            telegram_id=user_id,
-            username=username,
-            first_name=first_name,
-            last_name=last_name
+        # INSERT ... ON CONFLICT DO NOTHING: повторный /start не создаёт дубль и не гоняется с проверкой
+        await Users.bulk_create(
+            [Users(telegram_id=user_id, username=username, first_name=first_name, last_name=last_name)],
+            ignore_conflicts=True
         )
-        await new_users.save()
-        
-        logger.info(f"Создан новый пользователь: {user_id}")
+        logger.info(f"Пользователь {user_id} зарегистрирован")
     except Exception as e:
         logger.error(f"Ошибка при добавлении {user_id}: {e}")
         raise
 
-async def update_user_city(user_id: int, city: str) -> None:
+# Поля, от которых зависит расписание рассылки: их меняют только update_user_* и
+# delete_user_notifications, которые заодно обновляют schedule в памяти
+SCHEDULE_FIELDS = frozenset({
+    'city', 'city_id', 'notification_minute', 'notification_utc_minute', 'timezone', 'notifications_enabled'
+})
+
+@timed(db_query_duration, query='upsert_users')
+async def upsert_users(users: List[Dict[str, Any]], batch_size: int = 1000) -> None:
+    if not users:
+        return
+    for user in users:
+        if 'telegram_id' not in user:
+            raise ValueError(f"Не указан telegram_id: {user}")
+        blocked = SCHEDULE_FIELDS.intersection(user)
+        if blocked:
+            raise ValueError(f"Поля расписания нельзя менять массово: {sorted(blocked)}")
+    # Строки с разным набором полей пишутся отдельными запросами: иначе незаданные
+    # поля затёрлись бы значениями по умолчанию, а лишние поля не обновились бы
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for user in users:
+        groups.setdefault(tuple(sorted(field for field in user if field != 'telegram_id')), []).append(user)
+    try:
+        for update_fields, rows in groups.items():
+            await Users.bulk_create(
+                [Users(**user) for user in rows],
+                batch_size=batch_size,
+                on_conflict=['telegram_id'],
+                update_fields=list(update_fields) or None,
+                ignore_conflicts=not update_fields
+            )
+        logger.info(f"Зарегистрировано или обновлено пользователей: {len(users)}")
+    except Exception as e:
+        logger.error(f"Ошибка при массовом добавлении пользователей: {e}")
+        raise
+
+@timed(db_query_duration, query='update_user_city')
+async def update_user_city(user_id: int, city: str, city_id: Optional[int] = None) -> int:
     try:
-        user = await get_user_by_telegram_id(user_id)
-        if user:
-            user.city = city
-            await user.save()
+        updated = await Users.filter(telegram_id=user_id).update(city=city, city_id=city_id)
+        if updated:
+            schedule.set_city(user_id, city, city_id)
             logger.info(f"Обновлен город для пользователя {user_id}: {city}")
         else:
             logger.error(f"Пользователь {user_id} не найден")
+        return updated
     except Exception as e:
         logger.error(f"Ошибка при обновлении города для {user_id}: {e}")
         raise
 
-async def update_user_notification_time(user_id: int, time: str) -> None:
+@timed(db_query_duration, query='update_user_notification_time')
+async def update_user_notification_time(user_id: int, time: str, city: Optional[str] = None,
+                                        timezone: Optional[str] = None, city_id: Optional[int] = None) -> int:
     try:
-        user = await get_user_by_telegram_id(user_id)
-        if user:
-            user.notification_time = time
-            user.notifications_enabled = True
-            await user.save()
+        minute = time_to_minute(time)
+        utc_minute = to_utc_minute(minute, timezone)
+        fields: Dict[str, Any] = {
+            'notification_minute': minute,
+            'notification_utc_minute': utc_minute,
+            'timezone': timezone,
+            'notifications_enabled': True
+        }
+        if city:
+            fields['city'] = city
+            fields['city_id'] = city_id
+        updated = await Users.filter(telegram_id=user_id).update(**fields)
+        if updated:
+            if not city:
+                city, city_id = await Users.filter(telegram_id=user_id).first().values_list('city', 'city_id')
+            schedule.add(user_id, utc_minute, city, city_id)
+            _offsets.setdefault(timezone, local_utc_offset_minutes(timezone))
             logger.info(f"Обновлено время уведомлений для пользователя {user_id}: {time}")
         else:
             logger.error(f"Пользователь {user_id} не найден")
+        return updated
     except Exception as e:
         logger.error(f"Ошибка при обновлении времени уведомлений для {user_id}: {e}")
         raise
 
-async def get_users_for_notifications(current_time: str) -> List[Users]:
+@timed(db_query_duration, query='set_users_city_id')
+async def set_users_city_id(user_ids: List[int], city_id: int) -> int:
     try:
-        users = await Users.filter(notification_time=current_time, notifications_enabled=True)
+        updated = await Users.filter(telegram_id__in=user_ids).update(city_id=city_id)
+        for user_id in user_ids:
+            schedule.set_city_id(user_id, city_id)
+        return updated
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении id города {city_id}: {e}")
+        raise
+
+@timed(db_query_duration, query='get_users_for_notifications')
+async def get_users_for_notifications(utc_minute: int) -> List[Users]:
+    try:
+        # Попадает в частичный индекс users_notification_slot_idx
+        users = await Users.filter(notification_utc_minute=utc_minute, notifications_enabled=True)
         return users
     except Exception as e:
         logger.error(f"Ошибка при получении пользователей для уведомлений: {e}")
         return []
 
-async def delete_user_notifications(user_id: int) -> None:
+async def _save_utc_minutes(changed: Dict[int, List[int]]) -> None:
+    for utc_minute, user_ids in changed.items():
+        for i in range(0, len(user_ids), 1000):
+            await Users.filter(telegram_id__in=user_ids[i:i + 1000]).update(notification_utc_minute=utc_minute)
+
+
+def _recompute(rows: Iterable[Tuple[int, Optional[str], Optional[int], Optional[int], Optional[str], int]],
+               changed: Dict[int, List[int]]) -> List[Tuple[int, Optional[str], Optional[int], int]]:
+    # UTC-слот пересчитывается из местного времени по текущему смещению зоны:
+    # после перехода на летнее время уведомление остается в те же ЧЧ:ММ по местному
+    result = []
+    for telegram_id, city, city_id, minute, timezone, utc_minute in rows:
+        if minute is not None:
+            if timezone not in _offsets:
+                _offsets[timezone] = local_utc_offset_minutes(timezone)
+            actual = (minute - _offsets[timezone]) % MINUTES_PER_DAY
+            if actual != utc_minute:
+                changed.setdefault(actual, []).append(telegram_id)
+                utc_minute = actual
+        result.append((telegram_id, city, city_id, utc_minute))
+    return result
+
+
+@timed(db_query_duration, query='get_notification_schedule')
+async def get_notification_schedule() -> List[Tuple[int, Optional[str], Optional[int], int]]:
     try:
-        user = await get_user_by_telegram_id(user_id)
-        if user:
-            user.notification_time = None
-            user.notifications_enabled = False
-            await user.save()
+        _offsets.clear()
+        rows = await Users.filter(
+            notifications_enabled=True,
+            notification_utc_minute__isnull=False
+        ).values_list('telegram_id', 'city', 'city_id', 'notification_minute', 'timezone', 'notification_utc_minute')
+        changed: Dict[int, List[int]] = {}
+        result = _recompute(rows, changed)
+        await _save_utc_minutes(changed)
+        return result
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке расписания уведомлений: {e}")
+        raise
+
+@timed(db_query_duration, query='refresh_utc_minutes')
+async def refresh_utc_minutes() -> int:
+    # Проверка дешевая: в БД идем только за пользователями зон, у которых сменилось смещение
+    moved = [timezone for timezone, offset in _offsets.items() if local_utc_offset_minutes(timezone) != offset]
+    changed: Dict[int, List[int]] = {}
+    for timezone in moved:
+        del _offsets[timezone]
+        query = Users.filter(notifications_enabled=True, notification_minute__isnull=False)
+        query = query.filter(timezone=timezone) if timezone else query.filter(timezone__isnull=True)
+        rows = await query.values_list(
+            'telegram_id', 'city', 'city_id', 'notification_minute', 'timezone', 'notification_utc_minute'
+        )
+        for telegram_id, city, city_id, utc_minute in _recompute(rows, changed):
+            schedule.add(telegram_id, utc_minute, city, city_id)
+    await _save_utc_minutes(changed)
+    if moved:
+        logger.info(f"Смена смещения в зонах {moved}: перенесено уведомлений {sum(map(len, changed.values()))}")
+    return sum(map(len, changed.values()))
+
+@timed(db_query_duration, query='delete_user_notifications')
+async def delete_user_notifications(user_id: int) -> int:
+    try:
+        updated = await Users.filter(telegram_id=user_id).update(
+            notification_minute=None,
+            notification_utc_minute=None,
+            notifications_enabled=False
+        )
+        if updated:
+            schedule.remove(user_id)
             logger.info(f"Удалены уведомления для пользователя {user_id}")
         else:
             logger.error(f"Пользователь {user_id} не найден")
+        return updated
     except Exception as e:
         logger.error(f"Ошибка при удалении уведомлений для {user_id}: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    # Отложенная запись: значения копятся по ключу (последнее побеждает) и пишутся в БД
+    # пачкой раз в interval. Несохраненное при ошибке возвращается в буфер
+    def __init__(self, write: Callable[[Dict[Hashable, Any]], Awaitable[None]], interval: float, name: str):
+        self.interval = interval
+        self.name = name
+        self.pending: Dict[Hashable, Any] = {}
+        self._write = write
+        self._task: Optional[asyncio.Task] = None
+        self._closing = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def get(self, key: Hashable) -> Any:
+        return self.pending.get(key)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.pending[key] = value
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await self._write(batch)
+        except BaseException:
+            # Возвращаем несохранённое в буфер, не затирая более свежие записи
+            for key, value in batch.items():
+                self.pending.setdefault(key, value)
+            raise
+
+    async def close(self) -> None:
+        # Цикл не отменяется посреди записи: дожидаемся его и сбрасываем остаток
+        self._closing.set()
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._closing.clear()
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while self.pending and not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении {self.name}: {e}")
@@ -0,0 +1,49 @@
+from functools import lru_cache
+from aggregation import aggregate_daily
+from weather_models import CurrentWeather, Forecast
+
+# Тексты кэшируются по (снимок, город, язык): пока снимок лежит в кэше погоды,
+# повторные запросы получают уже готовую строку
+
+
+def _weather_lines(weather: CurrentWeather) -> str:
+    return (
+        f"🌡 Температура: {weather.temp}°C\n"
+        f"🌡 Ощущается как: {weather.feels_like}°C\n"
+        f"☁️ Описание: {weather.description}\n"
+        f"💧 Влажность: {weather.humidity}%\n"
+        f"🌪 Скорость ветра: {weather.wind_speed} м/с\n"
+        f"🔵 Давление: {weather.pressure} гПа"
+    )
+
+
+@lru_cache(maxsize=2048)
+def format_current_weather(weather: CurrentWeather, city: str, lang: str = 'ru') -> str:
+    return f"🏙 Погода в городе {city}:\n\n" + _weather_lines(weather)
+
+
+@lru_cache(maxsize=2048)
+def format_location_weather(weather: CurrentWeather, lang: str = 'ru') -> str:
+    return f"📍 Погода по вашему местоположению ({weather.city_name}):\n\n" + _weather_lines(weather)
+
+
+@lru_cache(maxsize=1024)
+def format_forecast(forecast: Forecast, city: str, lang: str = 'ru') -> str:
+    [daily_forecasts] = aggregate_daily([forecast], days=5)
+
+    # Формируем текст прогноза
+    forecast_text = f"📅 Прогноз погоды в городе {city} на 5 дней:\n\n"
+
+    for day in daily_forecasts:
+        forecast_text += (
+            f"📆 {day.date.isoformat()}\n"
+            f"🌡 Температура: {day.temp_min:.1f}°C - {day.temp_max:.1f}°C\n"
+            f"☁️ {day.description}\n"
+            f"💧 Влажность: {day.humidity:.0f}%\n"
+            f"🌪 Ветер: до {day.wind_max:.1f} м/с\n"
+        )
+        if day.precipitation > 0:
+            forecast_text += f"🌧 Осадки: {day.precipitation:.1f} мм\n"
+        forecast_text += "\n"
+
+    return forecast_text
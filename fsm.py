@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from config import FSM_MAX_ENTRIES, FSM_IDLE_TTL
+
+
+class BoundedMemoryStorage(BaseStorage):
+    # Записи упорядочены по последнему обращению: самые давние всегда в начале,
+    # поэтому и вытеснение по размеру, и очистка по простою идут с головы очереди.
+    # Пользователь без записи получает default_state, как после /start.
+    def __init__(
+        self,
+        default_state: Optional[str] = None,
+        max_entries: int = FSM_MAX_ENTRIES,
+        idle_ttl: float = FSM_IDLE_TTL,
+    ):
+        self.default_state = default_state
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._records: "OrderedDict[StorageKey, Tuple[Optional[str], Dict[str, Any], float]]" = OrderedDict()
+
+    def _get(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        record = self._records.get(key)
+        if record is None:
+            return self.default_state, {}
+        state, data, last_seen = record
+        now = time.monotonic()
+        if now - last_seen > self.idle_ttl:
+            del self._records[key]
+            self.expirations += 1
+            return self.default_state, {}
+        self._records[key] = (state, data, now)
+        self._records.move_to_end(key)
+        return state, data
+
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        if state == self.default_state and not data:
+            # Состояние по умолчанию хранить незачем
+            self._records.pop(key, None)
+        else:
+            self._records[key] = (state, data, now)
+            self._records.move_to_end(key)
+        self._sweep(now)
+
+    def _sweep(self, now: float) -> None:
+        while self._records:
+            oldest_key, (_, _, last_seen) = next(iter(self._records.items()))
+            if now - last_seen > self.idle_ttl:
+                self.expirations += 1
+            elif len(self._records) > self.max_entries:
+                self.evictions += 1
+            else:
+                break
+            del self._records[oldest_key]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = self._get(key)
+        self._put(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = self._get(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        state, _ = self._get(key)
+        self._put(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = self._get(key)
+        return data.copy()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': len(self._records),
+            'max_entries': self.max_entries,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    async def close(self) -> None:
+        self._records.clear()
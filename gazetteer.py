@@ -0,0 +1,129 @@
+import bisect
+import difflib
+import logging
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from config import GAZETTEER_PATH
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class City:
+    id: int
+    name: str
+    country: str
+    lat: float
+    lon: float
+    population: int
+
+
+def normalize_name(name: str) -> str:
+    # Без регистра, диакритики и дефисов: "Ростов-на-Дону" == "ростов на дону", "ё" == "е"
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.replace('-', ' ').replace('’', "'").split())
+
+
+def _parse_line(line: str) -> Optional[Tuple[City, List[str]]]:
+    columns = line.rstrip('\n').split('\t')
+    if len(columns) >= 19:
+        # Формат выгрузки GeoNames (cities15000.txt и т.п.)
+        city = City(
+            id=int(columns[0]), name=columns[1], country=columns[8],
+            lat=float(columns[4]), lon=float(columns[5]), population=int(columns[14] or 0),
+        )
+        return city, [columns[2]] + columns[3].split(',')
+    if len(columns) >= 6:
+        # Компактный формат data/cities.tsv: id, name, country, lat, lon, population[, alternate_names]
+        city = City(
+            id=int(columns[0]), name=columns[1], country=columns[2],
+            lat=float(columns[3]), lon=float(columns[4]), population=int(columns[5] or 0),
+        )
+        return city, columns[6].split(',') if len(columns) > 6 else []
+    return None
+
+
+class Gazetteer:
+    # Все названия и альтернативные имена лежат в одном отсортированном списке
+    # нормализованных ключей: точный поиск и поиск по префиксу — бинарный поиск
+    def __init__(self, cities: List[City], names: Dict[str, List[int]]):
+        self.cities = cities
+        self._keys = sorted(names)
+        # Для каждого ключа — индексы городов, самые населённые первыми
+        self._targets = [
+            sorted(set(names[key]), key=lambda index: -cities[index].population) for key in self._keys
+        ]
+
+    def __len__(self) -> int:
+        return len(self.cities)
+
+    @classmethod
+    def load(cls, path: str = GAZETTEER_PATH) -> "Gazetteer":
+        cities: List[City] = []
+        names: Dict[str, List[int]] = {}
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                parsed = _parse_line(line)
+                if parsed is None:
+                    continue
+                city, alternate_names = parsed
+                index = len(cities)
+                cities.append(city)
+                for name in [city.name] + alternate_names:
+                    key = normalize_name(name)
+                    if key:
+                        names.setdefault(key, []).append(index)
+        logger.info(f"Справочник городов загружен: {len(cities)} городов, {len(names)} названий")
+        return cls(cities, names)
+
+    def lookup(self, query: str) -> Optional[City]:
+        key = normalize_name(query)
+        position = bisect.bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            return self.cities[self._targets[position][0]]
+        return None
+
+    def complete(self, prefix: str, limit: int = 10) -> List[City]:
+        key = normalize_name(prefix)
+        if not key:
+            return []
+        start = bisect.bisect_left(self._keys, key)
+        end = bisect.bisect_left(self._keys, key + '\U0010ffff')
+        seen: Dict[int, City] = {}
+        for targets in self._targets[start:end]:
+            for index in targets:
+                seen.setdefault(index, self.cities[index])
+        return sorted(seen.values(), key=lambda city: -city.population)[:limit]
+
+    def suggest(self, query: str, limit: int = 3) -> List[City]:
+        key = normalize_name(query)
+        if not key:
+            return []
+        # Кандидаты — названия на ту же первую букву: опечатки обычно не в начале слова
+        start = bisect.bisect_left(self._keys, key[0])
+        end = bisect.bisect_left(self._keys, key[0] + '\U0010ffff')
+        candidates = self._keys[start:end][:20000]
+        suggestions: List[City] = []
+        for match in difflib.get_close_matches(key, candidates, n=limit * 2, cutoff=0.7):
+            city = self.cities[self._targets[start + candidates.index(match)][0]]
+            if city not in suggestions:
+                suggestions.append(city)
+        return suggestions[:limit]
+
+
+_gazetteer: Optional[Gazetteer] = None
+
+
+def get_gazetteer() -> Gazetteer:
+    global _gazetteer
+    if _gazetteer is None:
+        try:
+            _gazetteer = Gazetteer.load()
+        except OSError as e:
+            logger.error(f"Не удалось загрузить справочник городов {GAZETTEER_PATH}: {e}")
+            _gazetteer = Gazetteer([], {})
+    return _gazetteer
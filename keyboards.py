@@ -1,4 +1,6 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from callbacks import CityCallback, CityRef, WeatherAction
+from database.city_keys import city_keys
 
 def get_start_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
@@ -26,24 +28,28 @@ def get_back_keyboard() -> InlineKeyboardMarkup:
         ]
     )
 
-def get_weather_keyboard(city: str) -> InlineKeyboardMarkup:
+def city_button(text: str, action: WeatherAction, ref: CityRef) -> InlineKeyboardButton:
+    # В callback_data попадает только короткий ключ города, а не само название
+    return InlineKeyboardButton(text=text, callback_data=CityCallback(action=action, key=city_keys.intern(ref)).pack())
+
+def get_weather_keyboard(ref: CityRef) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="📅 Прогноз на 5 дней", callback_data=f"forecast_{city}")]
+            [city_button("📅 Прогноз на 5 дней", WeatherAction.FORECAST, ref)]
         ]
     )
 
-def get_forecast_keyboard(city: str) -> InlineKeyboardMarkup:
+def get_forecast_keyboard(ref: CityRef) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="📊 Подробнее", callback_data=f"detailed_forecast_{city}")],
-            [InlineKeyboardButton(text="◀️ Назад к погоде", callback_data=f"back_to_weather_{city}")]
+            [city_button("📊 Подробнее", WeatherAction.CHART, ref)],
+            [city_button("◀️ Назад к погоде", WeatherAction.WEATHER, ref)]
         ]
     )
 
-def get_graph_keyboard(city: str) -> InlineKeyboardMarkup:
+def get_graph_keyboard(ref: CityRef) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="◀️ Назад к прогнозу", callback_data=f"forecast_{city}")]
+            [city_button("◀️ Назад к прогнозу", WeatherAction.FORECAST, ref)]
         ]
     )
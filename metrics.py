@@ -0,0 +1,217 @@
+import bisect
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from aiohttp import web
+from aiogram import BaseMiddleware
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> Iterator[str]:
+        return iter(())
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class _ValueMetric(Metric):
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        # Значения, которые дешевле снять в момент сбора (статистика кэшей и т.п.)
+        self._function = function
+
+    def samples(self) -> Iterator[str]:
+        values = self._function() if self._function else self._values
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {value}"
+
+
+class Counter(_ValueMetric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_ValueMetric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики по корзинам..., +Inf], сумма
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {self._sums[key]}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_duration = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта хендлером aiogram", ("handler", "event")))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Исключения, вышедшие из хендлеров", ("handler", "event")))
+upstream_duration = registry.register(Histogram(
+    "openweather_request_duration_seconds", "Время запроса к OpenWeather", ("endpoint", "status")))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "Время запросов к базе данных", ("query",)))
+chart_render_duration = registry.register(Histogram(
+    "chart_render_duration_seconds", "Время отрисовки графика температуры", ()))
+notification_run_duration = registry.register(Histogram(
+    "notification_run_duration_seconds", "Длительность рассылки одного слота", (),
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)))
+notification_lag = registry.register(Gauge(
+    "notification_lag_seconds", "Отставание начала рассылки от минуты слота"))
+notifications_total = registry.register(Counter(
+    "notifications_total", "Уведомления по результату", ("result",)))
+
+_caches: Dict[str, Any] = {}
+
+
+def register_cache(name: str, cache: Any) -> None:
+    # Подходит любой объект со stats() в формате cache.TTLCache
+    _caches[name] = cache
+
+
+def _cache_stat(field: str) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    def collect() -> Dict[Tuple[str, ...], float]:
+        stats = {name: cache.stats() for name, cache in _caches.items()}
+        return {(name,): values[field] for name, values in stats.items() if field in values}
+    return collect
+
+
+registry.register(Counter("cache_hits_total", "Попадания в кэш", ("cache",), _cache_stat("hits")))
+registry.register(Counter("cache_misses_total", "Промахи кэша", ("cache",), _cache_stat("misses")))
+registry.register(Counter("cache_evictions_total", "Вытеснения из кэша", ("cache",), _cache_stat("evictions")))
+registry.register(Gauge("cache_size", "Число записей в кэше", ("cache",), _cache_stat("size")))
+registry.register(Gauge("cache_hit_ratio", "Доля попаданий в кэш", ("cache",), _cache_stat("hit_ratio")))
+
+
+def timed(histogram: Histogram, **labels: Any) -> Callable:
+    # Декоратор для корутин: время выполнения, в том числе завершившихся исключением
+    def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Внутренний middleware: к этому моменту фильтры пройдены и известен конкретный хендлер
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(self, handler: Callable, event: Any, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name, event=self.event)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, handler=name, event=self.event)
+
+
+def setup_dispatcher(dp: Any) -> None:
+    dp.message.middleware(HandlerMetricsMiddleware("message"))
+    dp.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
+
+
+def create_app() -> web.Application:
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Prometheus-Format": "0.0.4"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    if not port:
+        return None
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -1,30 +1,467 @@
 import asyncio
 import logging
 import datetime
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Set, Tuple
 from aiogram import Bot
-from database.users import get_users_for_notifications
-from weather import get_weather
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+from config import (
+    NOTIFICATION_CATCHUP_MINUTES,
+    NOTIFICATION_COORDINATION,
+    NOTIFICATION_DELIVERY_FLUSH_INTERVAL,
+    NOTIFICATION_HISTORY_MINUTES,
+    NOTIFICATION_LEASE_TTL,
+    NOTIFICATION_SHARDS,
+    NOTIFICATION_WORKER_ID,
+    NOTIFICATION_SEND_CONCURRENCY,
+    NOTIFICATION_SEND_RETRIES,
+    NOTIFICATION_PREFETCH_MINUTES,
+    OPENWEATHER_GROUP_LIMIT,
+    WEATHER_CACHE_TTL,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_INTERVAL,
+)
+from database.leases import (
+    claim_lease,
+    claim_prefetch,
+    complete_lease,
+    create_slot_leases,
+    get_abandoned_leases,
+    get_delivered,
+    get_shard_users,
+    has_due_users,
+    purge_notification_history,
+    record_deliveries,
+    renew_lease,
+)
+from database.users import get_notification_schedule, refresh_utc_minutes, set_users_city_id
+from formatting import format_current_weather
+from metrics import notification_lag, notification_run_duration, notifications_total
+from ratelimit import TelegramRateLimiter
+from scheduler import schedule, minute_to_time
+from upstream import SCHEDULED
+from weather import fetch_current_weather, fetch_weather_by_ids, normalize_city, needs_refresh, weather_age_note
+from weather_models import CurrentWeather
 
 logger = logging.getLogger(__name__)
 
+telegram_limiter = TelegramRateLimiter(TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_INTERVAL)
+# Ссылки на фоновые задачи прогрева, чтобы их не собрал сборщик мусора
+_prefetch_tasks = set()
+
+
+@dataclass
+class SlotWeather:
+    # Снимки, прогретые для слота. Держатся до его рассылки: в общем кэше крупный
+    # слот вытесняет сам себя раньше, чем до него дойдет очередь
+    by_id: Dict[int, CurrentWeather] = field(default_factory=dict)
+    by_name: Dict[str, CurrentWeather] = field(default_factory=dict)
+    # Шарды, прогретые этим процессом в режиме "database"
+    shards: Set[int] = field(default_factory=set)
+
+
+_prefetched: Dict[datetime.datetime, SlotWeather] = {}
+
+
+@dataclass
+class NotificationReport:
+    slot: str
+    users: int = 0
+    cities: int = 0
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    shards: int = 0
+    duration: float = 0.0
+
+
+class ShardLease:
+    # Захваченный шард слота: доставки отмечаются пачками, аренда продлевается,
+    # пока идет рассылка. Потерянная аренда (процесс завис дольше TTL) останавливает отправку
+    def __init__(self, slot: int, shard: int, owner: str):
+        self.slot = slot
+        self.shard = shard
+        self.owner = owner
+        self.lost = False
+        self._delivered: List[int] = []
+        self._stopped = asyncio.Event()
+
+    def delivered(self, telegram_id: int) -> None:
+        self._delivered.append(telegram_id)
+
+    async def flush(self) -> None:
+        if self._delivered:
+            batch, self._delivered = self._delivered, []
+            try:
+                await record_deliveries(self.slot, self.shard, batch)
+            except BaseException:
+                self._delivered = batch + self._delivered
+                raise
+        if not await renew_lease(self.slot, self.shard, self.owner, NOTIFICATION_LEASE_TTL):
+            self.lost = True
+
+    async def heartbeat(self) -> None:
+        # Останавливается флагом, а не отменой: оборванная на середине запись оставила бы
+        # открытую транзакцию, а ее пачка вернулась бы в буфер уже после финального flush
+        while not self.lost and not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), NOTIFICATION_DELIVERY_FLUSH_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Не удалось продлить аренду шарда {self.shard} слота {self.slot}: {e}")
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def _minute_start(moment: datetime.datetime) -> datetime.datetime:
+    return moment.replace(second=0, microsecond=0)
+
+
+def _slot_key(slot: datetime.datetime) -> int:
+    # Минута UTC от начала эпохи: однозначно задает слот конкретного дня
+    return int(slot.timestamp()) // 60
+
+
+def _slot_from_key(key: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(key * 60, datetime.timezone.utc)
+
+
+def _group_by_city(due: List[Tuple[int, Optional[str], Optional[int]]]) -> Dict[Hashable, List[Tuple[int, str]]]:
+    # Пользователи с известным id города группируются по id, остальные — по названию
+    groups: Dict[Hashable, List[Tuple[int, str]]] = {}
+    for telegram_id, city, city_id in due:
+        if city:
+            key = ('id', city_id) if city_id else ('name', normalize_city(city))
+            groups.setdefault(key, []).append((telegram_id, city))
+    return groups
+
+
+async def _send_with_retry(bot: Bot, telegram_id: int, text: str, report: NotificationReport) -> None:
+    for attempt in range(NOTIFICATION_SEND_RETRIES + 1):
+        await telegram_limiter.acquire(telegram_id)
+        try:
+            await bot.send_message(telegram_id, text)
+            report.sent += 1
+            logger.info(f"Отправлено уведомление о погоде пользователю {telegram_id}")
+            return
+        except TelegramRetryAfter as e:
+            if attempt == NOTIFICATION_SEND_RETRIES:
+                raise
+            report.retries += 1
+            logger.warning(f"Флуд-лимит Telegram, рассылка приостановлена на {e.retry_after} с")
+            # Повтор дождется конца паузы в telegram_limiter.acquire
+            telegram_limiter.pause(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if attempt == NOTIFICATION_SEND_RETRIES:
+                raise
+            report.retries += 1
+            logger.warning(f"Ошибка Telegram при отправке {telegram_id}, повтор через {2 ** attempt} с: {e}")
+            await asyncio.sleep(2 ** attempt)
+
+
+async def _send_city(bot: Bot, users: List[Tuple[int, str]], weather: Optional[CurrentWeather],
+                     semaphore: asyncio.Semaphore, report: NotificationReport,
+                     lease: Optional[ShardLease] = None) -> None:
+    city = users[0][1]
+    if weather is None:
+        try:
+            weather = await fetch_current_weather(city, priority=SCHEDULED)
+        except Exception as e:
+            report.failed += len(users)
+            logger.error(f"Не удалось получить погоду для {city}, пропущено {len(users)} уведомлений: {e}")
+            return
+        if weather.city_id is not None:
+            # Запоминаем id, чтобы в следующий раз город попал в пакетный запрос; ошибка записи рассылку не отменяет
+            try:
+                await set_users_city_id([telegram_id for telegram_id, _ in users], weather.city_id)
+            except Exception:
+                pass
+
+    text = f"Ваш ежедневный прогноз погоды:\n\n{format_current_weather(weather, city)}{weather_age_note(weather)}"
+
+    async def send(telegram_id: int) -> None:
+        async with semaphore:
+            if lease is not None and lease.lost:
+                return
+            try:
+                await _send_with_retry(bot, telegram_id, text, report)
+                if lease is not None:
+                    lease.delivered(telegram_id)
+            except Exception as e:
+                report.failed += 1
+                logger.error(f"Ошибка при отправке уведомления пользователю {telegram_id}: {e}")
+
+    await asyncio.gather(*(send(telegram_id) for telegram_id, _ in users))
+
+
+async def _send_due(bot: Bot, due: List[Tuple[int, Optional[str], Optional[int]]], report: NotificationReport,
+                    lease: Optional[ShardLease] = None, warm: Optional[SlotWeather] = None) -> None:
+    groups = _group_by_city(due)
+    report.users += len(due)
+    report.cities += len(groups)
+    if not groups:
+        return
+
+    warm = warm or SlotWeather()
+    weathers = {key: warm.by_id[key[1]] if key[0] == 'id' else warm.by_name[key[1]]
+                for key in groups if key[1] in (warm.by_id if key[0] == 'id' else warm.by_name)}
+    # Города с известным id, которых нет среди прогретых, забираем пачками, остальные — поштучно в _send_city
+    missing = [key[1] for key in groups if key[0] == 'id' and key not in weathers]
+    for city_id, weather in (await fetch_weather_by_ids(missing, priority=SCHEDULED)).items():
+        weathers[('id', city_id)] = weather
+    semaphore = asyncio.Semaphore(NOTIFICATION_SEND_CONCURRENCY)
+    await asyncio.gather(*(
+        _send_city(bot, users, weathers.get(key), semaphore, report, lease)
+        for key, users in groups.items()
+    ))
+
+
+def _finish_report(report: NotificationReport, started: float) -> NotificationReport:
+    report.duration = time.monotonic() - started
+    notification_run_duration.observe(report.duration)
+    notifications_total.inc(report.sent, result='sent')
+    notifications_total.inc(report.failed, result='failed')
+    notifications_total.inc(report.retries, result='retried')
+    if report.users:
+        logger.info(
+            f"Рассылка {report.slot}: пользователей {report.users}, городов {report.cities}, "
+            f"отправлено {report.sent}, ошибок {report.failed}, повторов {report.retries}, "
+            f"шардов {report.shards}, за {report.duration:.2f} с"
+        )
+    return report
+
+
+async def _send_slot(bot: Bot, slot: datetime.datetime) -> NotificationReport:
+    # Режим "local": весь слот из расписания в памяти
+    minute = slot.hour * 60 + slot.minute
+    report = NotificationReport(slot=minute_to_time(minute))
+    started = time.monotonic()
+    notification_lag.set((datetime.datetime.now(datetime.timezone.utc) - slot).total_seconds())
+    await _send_due(bot, schedule.due(minute), report, warm=_prefetched.pop(slot, None))
+    return _finish_report(report, started)
+
+
+async def _send_shard(bot: Bot, slot: datetime.datetime, shard: int, worker: str,
+                      report: NotificationReport) -> bool:
+    key = _slot_key(slot)
+    if not await claim_lease(key, shard, worker, NOTIFICATION_LEASE_TTL):
+        return False
+
+    lease = ShardLease(key, shard, worker)
+    heartbeat = asyncio.create_task(lease.heartbeat())
+    try:
+        due = await get_shard_users(slot.hour * 60 + slot.minute, NOTIFICATION_SHARDS, shard)
+        # После чужого сбоя часть шарда уже доставлена
+        delivered = await get_delivered(key, shard)
+        if delivered:
+            due = [row for row in due if row[0] not in delivered]
+        await _send_due(bot, due, report, lease, _prefetched.get(slot))
+    finally:
+        lease.stop()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+        await lease.flush()
+    if lease.lost or not await complete_lease(key, shard, worker):
+        logger.warning(f"Аренда шарда {shard} за {report.slot} потеряна, его дошлет другой процесс")
+    report.shards += 1
+    return True
+
+
+async def _send_slot_leased(bot: Bot, slot: datetime.datetime,
+                            worker: str = NOTIFICATION_WORKER_ID) -> NotificationReport:
+    # Режим "database": процессы разбирают шарды слота, каждый шард рассылает один из них
+    minute = slot.hour * 60 + slot.minute
+    report = NotificationReport(slot=minute_to_time(minute))
+    started = time.monotonic()
+    notification_lag.set((datetime.datetime.now(datetime.timezone.utc) - slot).total_seconds())
+
+    if not await has_due_users(minute):
+        return _finish_report(report, started)
+    await create_slot_leases(_slot_key(slot), NOTIFICATION_SHARDS)
+    # Сначала шарды, погоду для которых прогрел этот процесс; остальные — со случайного,
+    # чтобы процессы реже сталкивались на захвате
+    own = sorted(_prefetched[slot].shards) if slot in _prefetched else []
+    offset = random.randrange(NOTIFICATION_SHARDS)
+    rest = [(offset + index) % NOTIFICATION_SHARDS for index in range(NOTIFICATION_SHARDS)]
+    for shard in own + [shard for shard in rest if shard not in own]:
+        try:
+            await _send_shard(bot, slot, shard, worker, report)
+        except Exception as e:
+            # Аренда истечет, и шард подхватит _reclaim_abandoned
+            logger.error(f"Ошибка при рассылке шарда {shard} за {report.slot}: {e}")
+    _prefetched.pop(slot, None)
+    return _finish_report(report, started)
+
+
+async def _reclaim_abandoned(bot: Bot, current_slot: datetime.datetime,
+                             worker: str = NOTIFICATION_WORKER_ID) -> None:
+    # Шарды, брошенные упавшим или зависшим процессом, досылает тот, кто первым их заметит
+    since = _slot_key(current_slot) - NOTIFICATION_CATCHUP_MINUTES
+    for key, shard in await get_abandoned_leases(since, _slot_key(current_slot)):
+        slot = _slot_from_key(key)
+        report = NotificationReport(slot=minute_to_time(slot.hour * 60 + slot.minute))
+        started = time.monotonic()
+        try:
+            if await _send_shard(bot, slot, shard, worker, report):
+                logger.info(f"Подхвачен брошенный шард {shard} за {report.slot}")
+                _finish_report(report, started)
+        except Exception as e:
+            logger.error(f"Ошибка при досылке шарда {shard} за {report.slot}: {e}")
+
+
+async def _prefetch_groups(slot: datetime.datetime, groups: Dict[Hashable, List[Tuple[int, str]]],
+                           window: float) -> None:
+    # Погода для городов слота запрашивается равномерно в течение окна перед ним,
+    # так что к началу слота рассылка обходится без запросов к OpenWeather
+    minute = slot.hour * 60 + slot.minute
+    warm = _prefetched.setdefault(slot, SlotWeather())
+    horizon = (slot - datetime.datetime.now(datetime.timezone.utc)).total_seconds() + 60
+    city_ids = [key[1] for key in groups if key[0] == 'id']
+    names = {key[1]: users[0][1] for key, users in groups.items() if key[0] == 'name'}
+    stale_ids = [city_id for city_id in city_ids if needs_refresh(city_id=city_id, fresh_for=horizon)]
+    stale_names = {name for name, city in names.items() if needs_refresh(city=city, fresh_for=horizon)}
+
+    async def warm_ids(chunk: List[int], refresh: bool) -> None:
+        warm.by_id.update(await fetch_weather_by_ids(chunk, priority=SCHEDULED, refresh=refresh))
+
+    async def warm_name(name: str, refresh: bool) -> None:
+        warm.by_name[name] = await fetch_current_weather(names[name], priority=SCHEDULED, refresh=refresh)
+
+    # Свежие снимки забираем из кэша сразу, в окне распределяем только запросы к OpenWeather
+    try:
+        await warm_ids([city_id for city_id in city_ids if city_id not in set(stale_ids)], False)
+        for name in names.keys() - stale_names:
+            await warm_name(name, False)
+    except Exception as e:
+        logger.warning(f"Не удалось прогреть кэш погоды для {minute_to_time(minute)}: {e}")
+
+    jobs = [
+        lambda chunk=stale_ids[i:i + OPENWEATHER_GROUP_LIMIT]: warm_ids(chunk, True)
+        for i in range(0, len(stale_ids), OPENWEATHER_GROUP_LIMIT)
+    ] + [lambda name=name: warm_name(name, True) for name in stale_names]
+    if not jobs:
+        return
+
+    started = time.monotonic()
+    step = window / len(jobs)
+    for index, job in enumerate(jobs):
+        await asyncio.sleep(max(started + index * step - time.monotonic(), 0))
+        try:
+            await job()
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть кэш погоды для {minute_to_time(minute)}: {e}")
+    logger.info(
+        f"Кэш погоды для {minute_to_time(minute)} прогрет: городов {len(stale_ids) + len(stale_names)}, "
+        f"запросов {len(jobs)} за {time.monotonic() - started:.0f} с"
+    )
+
+
+async def _prefetch_slot(slot: datetime.datetime, window: float) -> None:
+    await _prefetch_groups(slot, _group_by_city(schedule.due(slot.hour * 60 + slot.minute)), window)
+
+
+async def _prefetch_slot_leased(slot: datetime.datetime, window: float,
+                                worker: str = NOTIFICATION_WORKER_ID) -> None:
+    # Режим "database": шарды слота прогревают разные процессы, каждый город — один раз на все реплики
+    minute = slot.hour * 60 + slot.minute
+    key = _slot_key(slot)
+    try:
+        if not await has_due_users(minute):
+            return
+        await create_slot_leases(key, NOTIFICATION_SHARDS)
+        warm = _prefetched.setdefault(slot, SlotWeather())
+        offset = random.randrange(NOTIFICATION_SHARDS)
+        for index in range(NOTIFICATION_SHARDS):
+            shard = (offset + index) % NOTIFICATION_SHARDS
+            if not await claim_prefetch(key, shard, worker):
+                continue
+            warm.shards.add(shard)
+            due = await get_shard_users(minute, NOTIFICATION_SHARDS, shard)
+            await _prefetch_groups(slot, _group_by_city(due), window / NOTIFICATION_SHARDS)
+    except Exception as e:
+        logger.warning(f"Не удалось прогреть шарды для {minute_to_time(minute)}: {e}")
+
+
+def _schedule_prefetch(current_slot: datetime.datetime, first_run: bool) -> None:
+    # Горизонт короче TTL кэша, иначе ранние снимки истекут до начала слота
+    lookahead = min(NOTIFICATION_PREFETCH_MINUTES, int(WEATHER_CACHE_TTL // 60) - 1)
+    if lookahead <= 0:
+        return
+    # При запуске прогреваем все слоты горизонта в укороченных окнах, дальше — по одному слоту в минуту
+    ahead = range(1, lookahead + 1) if first_run else [lookahead]
+    for minutes in ahead:
+        slot = current_slot + datetime.timedelta(minutes=minutes)
+        # Последний запрос окна уходит за минуту до слота
+        prefetch = _prefetch_slot_leased if NOTIFICATION_COORDINATION == "database" else _prefetch_slot
+        task = asyncio.create_task(prefetch(slot, (minutes - 1) * 60))
+        _prefetch_tasks.add(task)
+        task.add_done_callback(_prefetch_tasks.discard)
+
+
 async def send_weather_notifications(bot: Bot):
+    last_slot: Optional[datetime.datetime] = None
+    last_refresh: Optional[datetime.datetime] = None
     while True:
         try:
-            current_time = datetime.datetime.now().strftime("%H:%M")
-            
-            users = await get_users_for_notifications(current_time)
-            
-            for user in users:
-                if user.city:
-                    try:
-                        weather_data = await get_weather(user.city)
-                        await bot.send_message(user.telegram_id, 
-                                              f"Ваш ежедневный прогноз погоды:\n\n{weather_data}")
-                        logger.info(f"Отправлено уведомление о погоде пользователю {user.telegram_id}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке уведомления пользователю {user.telegram_id}: {e}")
-            
-            await asyncio.sleep(60)
+            if not schedule.loaded:
+                schedule.load(await get_notification_schedule())
+
+            # Слоты расписания хранятся в UTC
+            current_slot = _minute_start(datetime.datetime.now(datetime.timezone.utc))
+            coordinated = NOTIFICATION_COORDINATION == "database"
+            if last_slot is None:
+                # После перезапуска или деплоя досылаем минуты, пропущенные, пока процесс лежал:
+                # аренды и записи о доставке не дадут отправить уже разосланное второй раз.
+                # Без них (режим "local") неизвестно, что успело уйти, поэтому начинаем с текущей
+                catchup = NOTIFICATION_CATCHUP_MINUTES if coordinated else 1
+                slots = [current_slot - datetime.timedelta(minutes=i) for i in range(catchup - 1, -1, -1)]
+            else:
+                # Досылаем минуты, пропущенные из-за долгой обработки предыдущих
+                missed = int((current_slot - last_slot).total_seconds() // 60)
+                if missed > NOTIFICATION_CATCHUP_MINUTES:
+                    logger.warning(f"Пропущено {missed} минут рассылки, досылаем последние {NOTIFICATION_CATCHUP_MINUTES}")
+                    missed = NOTIFICATION_CATCHUP_MINUTES
+                slots = [current_slot - datetime.timedelta(minutes=i) for i in range(missed - 1, -1, -1)]
+
+            # Смещения зон меняются на границе часа, получаса (Ньюфаундленд, Лорд-Хау) или
+            # четверти часа; сверяем их раз в четверть часа, даже если досылка перескочила границу
+            quarter = current_slot.replace(minute=current_slot.minute // 15 * 15)
+            if quarter != last_refresh:
+                try:
+                    await refresh_utc_minutes()
+                    last_refresh = quarter
+                except Exception as e:
+                    logger.error(f"Не удалось пересчитать слоты уведомлений: {e}")
+
+            # Прогрев слотов, которые так и не были разосланы этим процессом
+            for slot in [slot for slot in _prefetched if slot < current_slot - datetime.timedelta(minutes=NOTIFICATION_CATCHUP_MINUTES)]:
+                del _prefetched[slot]
+            _schedule_prefetch(current_slot, first_run=last_slot is None)
+
+            for slot in slots:
+                if slot != current_slot:
+                    logger.info(f"Досылаем уведомления за {minute_to_time(slot.hour * 60 + slot.minute)}")
+                if coordinated:
+                    await _send_slot_leased(bot, slot)
+                else:
+                    await _send_slot(bot, slot)
+            last_slot = current_slot
+
+            if coordinated:
+                await _reclaim_abandoned(bot, current_slot)
+                if current_slot.minute == 0:
+                    await purge_notification_history(_slot_key(current_slot) - NOTIFICATION_HISTORY_MINUTES)
+
+            # Просыпаемся ровно на границе следующей минуты
+            next_slot = current_slot + datetime.timedelta(minutes=1)
+            delay = (next_slot - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            await asyncio.sleep(max(delay, 0))
         except Exception as e:
             logger.error(f"Ошибка в процессе отправки уведомлений: {e}")
-            await asyncio.sleep(60) 
\ No newline at end of file
+            await asyncio.sleep(1)
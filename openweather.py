@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+import aiohttp
+from config import (
+    OPENWEATHER_API_KEY,
+    OPENWEATHER_POOL_SIZE,
+    OPENWEATHER_CONCURRENCY,
+    OPENWEATHER_TIMEOUT,
+    OPENWEATHER_DNS_TTL,
+    OPENWEATHER_KEEPALIVE,
+)
+from metrics import upstream_duration
+
+logger = logging.getLogger(__name__)
+
+
+class OpenWeatherError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class OpenWeatherClient:
+    def __init__(
+        self,
+        api_key: str = OPENWEATHER_API_KEY,
+        pool_size: int = OPENWEATHER_POOL_SIZE,
+        concurrency: int = OPENWEATHER_CONCURRENCY,
+        timeout: float = OPENWEATHER_TIMEOUT,
+        dns_ttl: int = OPENWEATHER_DNS_TTL,
+        keepalive: float = OPENWEATHER_KEEPALIVE,
+    ):
+        self._api_key = api_key
+        self._pool_size = pool_size
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._dns_ttl = dns_ttl
+        self._keepalive = keepalive
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Сессия создаётся лениво, чтобы клиент можно было собрать вне event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._pool_size,
+                limit_per_host=self._pool_size,
+                ttl_dns_cache=self._dns_ttl,
+                keepalive_timeout=self._keepalive,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self._timeout)
+        return self._session
+
+    async def get_json(self, url: str, params: Dict[str, Any], error_message: str) -> Dict[str, Any]:
+        params = {**params, 'appid': self._api_key}
+        endpoint = url.rsplit('/', 1)[-1]
+        status = 'error'
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                async with self.session.get(url, params=params) as response:
+                    status = response.status
+                    if response.status != 200:
+                        raise OpenWeatherError(f"{error_message}. Код ошибки: {response.status}", response.status)
+                    return await response.json()
+            finally:
+                upstream_duration.observe(time.perf_counter() - started, endpoint=endpoint, status=status)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_client: Optional[OpenWeatherClient] = None
+
+
+def get_client() -> OpenWeatherClient:
+    global _client
+    if _client is None:
+        _client = OpenWeatherClient()
+    return _client
+
+
+async def setup() -> None:
+    get_client()
+    logger.info("Клиент OpenWeather инициализирован")
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+        logger.info("Клиент OpenWeather закрыт")
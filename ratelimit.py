@@ -0,0 +1,63 @@
+import asyncio
+import time
+from typing import Dict
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def block(self, seconds: float) -> None:
+        # Никто не получает токены до истечения паузы
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        self._refill()
+        if time.monotonic() < self._blocked_until:
+            return False
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1) -> None:
+        # Под замком ожидающие обслуживаются по очереди
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(max(self._blocked_until - time.monotonic(), (tokens - self._tokens) / self.rate))
+
+
+class TelegramRateLimiter:
+    def __init__(self, global_rate: float, chat_interval: float):
+        self.chat_interval = chat_interval
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_next: Dict[int, float] = {}
+
+    async def acquire(self, chat_id: int) -> None:
+        now = time.monotonic()
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: at for chat, at in self._chat_next.items() if at > now}
+        ready_at = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = ready_at + self.chat_interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        await self._global.acquire()
+
+    def pause(self, seconds: float) -> None:
+        # Флуд-лимит Telegram действует на весь бот: останавливаем все отправки, а не только упавшую
+        self._global.block(seconds)
@@ -0,0 +1,79 @@
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def time_to_minute(time: str) -> int:
+    hours, minutes = time.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def minute_to_time(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def local_utc_offset_minutes(timezone: Optional[str] = None) -> int:
+    now = datetime.now(ZoneInfo(timezone)) if timezone else datetime.now().astimezone()
+    return int(now.utcoffset().total_seconds() // 60)
+
+
+def to_utc_minute(minute: int, timezone: Optional[str] = None) -> int:
+    # Смещение берётся на момент записи: после перехода на летнее время слот пересчитывается при следующем сохранении
+    return (minute - local_utc_offset_minutes(timezone)) % MINUTES_PER_DAY
+
+
+class NotificationSchedule:
+    def __init__(self):
+        # minute of day (UTC) -> {telegram_id: (city, city_id)}
+        self._slots: Dict[int, Dict[int, Tuple[Optional[str], Optional[int]]]] = {}
+        # telegram_id -> minute of day
+        self._minutes: Dict[int, int] = {}
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._minutes)
+
+    def load(self, rows: Iterable[Tuple[int, Optional[str], Optional[int], int]]) -> None:
+        self._slots.clear()
+        self._minutes.clear()
+        for telegram_id, city, city_id, utc_minute in rows:
+            self.add(telegram_id, utc_minute, city, city_id)
+        self.loaded = True
+        logger.info(f"Расписание уведомлений загружено: {len(self)} пользователей")
+
+    def add(self, telegram_id: int, minute: int, city: Optional[str], city_id: Optional[int] = None) -> None:
+        self.remove(telegram_id)
+        self._slots.setdefault(minute, {})[telegram_id] = (city, city_id)
+        self._minutes[telegram_id] = minute
+
+    def set_city(self, telegram_id: int, city: Optional[str], city_id: Optional[int] = None) -> None:
+        minute = self._minutes.get(telegram_id)
+        if minute is not None:
+            self._slots[minute][telegram_id] = (city, city_id)
+
+    def set_city_id(self, telegram_id: int, city_id: int) -> None:
+        minute = self._minutes.get(telegram_id)
+        if minute is not None:
+            city, _ = self._slots[minute][telegram_id]
+            self._slots[minute][telegram_id] = (city, city_id)
+
+    def remove(self, telegram_id: int) -> None:
+        minute = self._minutes.pop(telegram_id, None)
+        if minute is None:
+            return
+        slot = self._slots[minute]
+        slot.pop(telegram_id, None)
+        if not slot:
+            del self._slots[minute]
+
+    def due(self, minute: int) -> List[Tuple[int, Optional[str], Optional[int]]]:
+        slot = self._slots.get(minute % MINUTES_PER_DAY, {})
+        return [(telegram_id, city, city_id) for telegram_id, (city, city_id) in slot.items()]
+
+
+schedule = NotificationSchedule()
@@ -0,0 +1,29 @@
+import asyncio
+import os
+import sys
+import pytest
+
+# config.py требует токены при импорте; тестам сеть не нужна, Postgres заменяет SQLite в памяти
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("OPENWEATHER_API_KEY", "test")
+os.environ.setdefault("POSTGRES_URI", "sqlite://:memory:")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def with_db():
+    # Каждый сценарий получает чистую базу со схемой и миграциями
+    def run(scenario):
+        import database
+        from tortoise import Tortoise
+
+        async def main():
+            await database.setup()
+            try:
+                return await scenario()
+            finally:
+                await Tortoise.close_connections()
+
+        return asyncio.run(main())
+
+    return run
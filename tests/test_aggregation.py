@@ -0,0 +1,79 @@
+import json
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from aggregation import aggregate_daily
+from weather_models import Forecast, ForecastPoint
+
+FIXTURE = Path(__file__).parent.parent / "bench" / "fixtures" / "forecast.json"
+
+
+def make_forecast(name: str, start: datetime, temps, descriptions) -> Forecast:
+    points = tuple(
+        ForecastPoint(
+            time=start + timedelta(hours=3 * index),
+            temp=temp,
+            temp_min=temp - 1,
+            temp_max=temp + 1,
+            description=description,
+            humidity=50 + index,
+            wind_speed=float(index),
+            precipitation=0.5,
+        )
+        for index, (temp, description) in enumerate(zip(temps, descriptions))
+    )
+    return Forecast(city_name=name, city_id=None, points=points)
+
+
+def naive_daily(forecast: Forecast, days: int = 5):
+    groups = {}
+    for point in forecast.points:
+        groups.setdefault(point.time.date(), []).append(point)
+    result = []
+    for day, points in list(groups.items())[:days]:
+        tally = Counter(point.description for point in points)
+        top = max(tally.values())
+        result.append((
+            day,
+            min(point.temp_min for point in points),
+            max(point.temp_max for point in points),
+            sum(point.temp for point in points) / len(points),
+            # При равенстве подходит любое из самых частых описаний
+            {description for description, count in tally.items() if count == top},
+            sum(point.precipitation for point in points),
+        ))
+    return result
+
+
+def assert_matches(daily, expected):
+    assert len(daily) == len(expected)
+    for got, want in zip(daily, expected):
+        assert (got.date, got.temp_min, got.temp_max) == want[:3]
+        assert abs(got.temp_mean - want[3]) < 1e-9
+        assert got.description in want[4]
+        assert abs(got.precipitation - want[5]) < 1e-9
+
+
+def test_groups_by_city_and_day():
+    # Первая точка в 21:00, поэтому первый день состоит из одной точки
+    first = make_forecast("A", datetime(2026, 1, 1, 21), [1, 2, 3, 4, 5], ["ясно", "снег", "снег", "ясно", "снег"])
+    second = make_forecast("B", datetime(2026, 1, 1, 0), [10, 20], ["дождь", "дождь"])
+    daily_a, daily_b = aggregate_daily([first, second])
+
+    assert [d.date.day for d in daily_a] == [1, 2]
+    assert_matches(daily_a, naive_daily(first))
+    assert daily_a[1].description == "снег"
+    assert daily_b[0].temp_mean == 15 and daily_b[0].temp_min == 9 and daily_b[0].temp_max == 21
+
+
+def test_matches_naive_on_fixture():
+    forecast = Forecast.from_api(json.loads(FIXTURE.read_text()))
+    (daily,) = aggregate_daily([forecast])
+    assert 1 <= len(daily) <= 5
+    assert_matches(daily, naive_daily(forecast))
+
+
+def test_limits_days_and_handles_empty():
+    forecast = make_forecast("A", datetime(2026, 1, 1), range(8 * 7), ["ясно"] * 8 * 7)
+    assert len(aggregate_daily([forecast], days=3)[0]) == 3
+    assert aggregate_daily([]) == []
@@ -0,0 +1,101 @@
+import asyncio
+import time
+import pytest
+from cache import SingleFlight, TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+def test_ttl_expiry_and_stale(clock):
+    cache = TTLCache(maxsize=10, ttl=5, stale_ttl=10)
+    cache.set("a", 1)
+    assert cache.get("a") == 1 and "a" in cache
+    clock.now += 6
+    assert cache.get("a") is None and "a" not in cache
+    assert cache.get_stale("a") == 1
+    assert cache.stale_age("a") == pytest.approx(6)
+    clock.now += 10
+    assert cache.get_stale("a") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_lru_eviction(clock):
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_single_flight_shares_one_call():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(5)))
+        return results, flight
+
+    results, flight = asyncio.run(scenario())
+    assert results == ["value"] * 5
+    assert calls == 1 and flight.shared == 4 and len(flight) == 0
+
+
+def test_single_flight_error_reaches_every_waiter():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(3)), return_exceptions=True)
+        return results, flight
+
+    results, flight = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    # Ошибка не закэширована: следующий вызов идёт заново
+    assert len(flight) == 0
+
+
+def test_single_flight_cancelled_waiter_keeps_fetch():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def scenario():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("k", fetch))
+        second = asyncio.create_task(flight.do("k", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "value"
+    assert calls == 1
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import charts
+
+
+def test_timed_out_render_keeps_its_queue_slot(monkeypatch):
+    gate = threading.Event()
+
+    def slow_render(title, times, temps):
+        gate.wait(5)
+        return b"png"
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(charts, "_executor", executor)
+    monkeypatch.setattr(charts, "_render_temperature_chart", slow_render)
+    monkeypatch.setattr(charts, "CHART_QUEUE_SIZE", 1)
+    monkeypatch.setattr(charts, "CHART_TIMEOUT", 0.05)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await charts.render_temperature_chart("Москва", [], [])
+        # Отрисовка всё ещё занимает воркер, поэтому новую не принимаем
+        with pytest.raises(charts.ChartQueueFullError):
+            await charts.render_temperature_chart("Москва", [], [])
+        gate.set()
+        for _ in range(100):
+            if charts._pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        return await charts.render_temperature_chart("Москва", [], [])
+
+    try:
+        assert asyncio.run(scenario()) == b"png"
+        assert charts._pending == 0
+    finally:
+        gate.set()
+        executor.shutdown()
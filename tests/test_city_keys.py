@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from callbacks import CityCallback, CityRef, WeatherAction, city_key
+from database.city_keys import CityKeyRegistry
+from database.models import CityKey
+from database.write_behind import WriteBehindBuffer
+
+REF = CityRef("Санкт-Петербург")
+COORDS = CityRef("Москва", 55.75, 37.6)
+
+
+def test_callback_fits_telegram_limit():
+    data = CityCallback(action=WeatherAction.FORECAST, key=city_key(CityRef("Х" * 200))).pack()
+    assert len(data.encode()) <= 64
+    assert city_key(REF) == city_key(CityRef("Санкт-Петербург"))
+
+
+def test_key_from_another_replica_resolves_from_db(with_db):
+    async def scenario():
+        first, second = CityKeyRegistry(flush_interval=60), CityKeyRegistry(flush_interval=60)
+        keys = first.intern(REF), first.intern(COORDS)
+        # До записи в БД ключ известен только выдавшему его процессу
+        before = await first.resolve(keys[0]), await second.resolve(keys[0])
+        await first.close()
+        after = [await second.resolve(key) for key in keys]
+        return before, after, await CityKey.all().count(), await second.resolve("missing0")
+
+    before, after, rows, missing = with_db(scenario)
+    assert before == (REF, None)
+    assert after == [REF, COORDS]
+    assert rows == 2
+    assert missing is None
+
+
+def test_failed_flush_keeps_the_batch():
+    calls = []
+
+    async def write(batch):
+        calls.append(dict(batch))
+        if len(calls) == 1:
+            raise ConnectionError("БД недоступна")
+
+    async def scenario():
+        buffer = WriteBehindBuffer(write, 60, "тест")
+        buffer.put("a", 1)
+        with pytest.raises(ConnectionError):
+            await buffer.flush()
+        # Более свежая запись не затирается восстановленной пачкой
+        buffer.put("a", 2)
+        buffer.put("b", 3)
+        await buffer.close()
+        return len(buffer)
+
+    assert asyncio.run(scenario()) == 0
+    assert calls == [{"a": 1}, {"a": 2, "b": 3}]
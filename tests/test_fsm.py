@@ -0,0 +1,56 @@
+import asyncio
+import time
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from fsm import BoundedMemoryStorage
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_evicts_least_recently_used(clock):
+    async def scenario():
+        storage = BoundedMemoryStorage(max_entries=2, idle_ttl=3600)
+        await storage.set_state(key(1), "a")
+        await storage.set_state(key(2), "b")
+        await storage.get_state(key(1))
+        await storage.set_state(key(3), "c")
+        return storage, [await storage.get_state(key(user)) for user in (1, 2, 3)]
+
+    storage, states = asyncio.run(scenario())
+    assert states == ["a", None, "c"]
+    assert storage.evictions == 1
+
+
+def test_idle_entries_expire_to_default(clock):
+    async def scenario():
+        storage = BoundedMemoryStorage(default_state="start", max_entries=10, idle_ttl=60)
+        await storage.set_state(key(1), "waiting_city")
+        await storage.set_data(key(1), {"city": "Москва"})
+        clock[0] += 61
+        return storage, await storage.get_state(key(1)), await storage.get_data(key(1))
+
+    storage, state, data = asyncio.run(scenario())
+    assert (state, data) == ("start", {})
+    assert storage.expirations == 1 and storage.stats()["size"] == 0
+
+
+def test_default_state_is_not_stored(clock):
+    async def scenario():
+        storage = BoundedMemoryStorage(max_entries=10, idle_ttl=60)
+        await storage.set_state(key(1), "x")
+        await storage.set_state(key(1), None)
+        data = await storage.get_data(key(1))
+        data["leak"] = True
+        return storage, await storage.get_data(key(1))
+
+    storage, data = asyncio.run(scenario())
+    assert data == {} and storage.stats()["size"] == 0
@@ -0,0 +1,108 @@
+import asyncio
+import datetime
+import json
+from collections import Counter
+from pathlib import Path
+import pytest
+import notifications
+from config import NOTIFICATION_SHARDS
+from database.leases import (
+    claim_lease,
+    complete_lease,
+    create_slot_leases,
+    get_abandoned_leases,
+    get_delivered,
+    record_deliveries,
+)
+from database.models import Users
+from ratelimit import TelegramRateLimiter
+from weather_models import CurrentWeather
+
+WEATHER = CurrentWeather.from_api(json.loads((Path(__file__).parent.parent / "bench" / "fixtures" / "weather.json").read_text()))
+SLOT = datetime.datetime(2026, 1, 1, 8, 30, tzinfo=datetime.timezone.utc)
+KEY = notifications._slot_key(SLOT)
+USERS = range(1, 101)
+
+
+@pytest.fixture(autouse=True)
+def limiter(monkeypatch):
+    # Ограничитель держит asyncio.Lock, привязанный к циклу событий; у каждого теста цикл свой
+    monkeypatch.setattr(notifications, "telegram_limiter", TelegramRateLimiter(10000, 0))
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = Counter()
+
+    async def send_message(self, chat_id: int, text: str) -> None:
+        self.sent[chat_id] += 1
+
+
+def warm_slot() -> None:
+    # Погода уже прогрета, рассылке не нужен OpenWeather
+    notifications._prefetched[SLOT] = notifications.SlotWeather(by_name={"москва": WEATHER})
+
+
+async def add_due_users() -> None:
+    await Users.bulk_create([
+        Users(telegram_id=telegram_id, city="Москва", notification_minute=510,
+              notification_utc_minute=510, notifications_enabled=True)
+        for telegram_id in USERS
+    ])
+
+
+def test_claim_is_exclusive_until_expiry(with_db):
+    async def scenario():
+        await create_slot_leases(KEY, 2)
+        await create_slot_leases(KEY, 2)
+        results = [await claim_lease(KEY, 0, "a", 60), await claim_lease(KEY, 0, "b", 60)]
+        # Аренда "c" на шарде 1 сразу истекает, как у зависшего процесса
+        results.append(await claim_lease(KEY, 1, "c", -1))
+        abandoned = await get_abandoned_leases(KEY, KEY + 1)
+        results.append(await claim_lease(KEY, 1, "b", 60))
+        results.append(await complete_lease(KEY, 1, "c"))
+        await complete_lease(KEY, 1, "b")
+        results.append(await claim_lease(KEY, 1, "a", -1))
+        return results, abandoned, await get_abandoned_leases(KEY, KEY + 1)
+
+    results, abandoned, after = with_db(scenario)
+    assert results == [True, False, True, True, False, False]
+    assert abandoned == [(KEY, 1)]
+    assert after == []
+
+
+def test_slot_is_sent_once_across_workers(with_db):
+    async def scenario():
+        await add_due_users()
+        bot = FakeBot()
+        warm_slot()
+        first = await notifications._send_slot_leased(bot, SLOT, worker="a")
+        warm_slot()
+        second = await notifications._send_slot_leased(bot, SLOT, worker="b")
+        notifications._prefetched.pop(SLOT, None)
+        return bot.sent, first, second
+
+    sent, first, second = with_db(scenario)
+    assert sent == Counter({telegram_id: 1 for telegram_id in USERS})
+    assert (first.sent, first.shards) == (len(USERS), NOTIFICATION_SHARDS)
+    assert (second.sent, second.shards) == (0, 0)
+
+
+def test_reclaim_skips_users_already_delivered(with_db):
+    async def scenario():
+        await add_due_users()
+        await create_slot_leases(KEY, NOTIFICATION_SHARDS)
+        # Процесс взял шард 0, успел отправить части пользователей и упал
+        shard_users = [telegram_id for telegram_id in USERS if telegram_id % NOTIFICATION_SHARDS == 0]
+        await claim_lease(KEY, 0, "dead", -1)
+        await record_deliveries(KEY, 0, shard_users[:3])
+        bot = FakeBot()
+        warm_slot()
+        await notifications._reclaim_abandoned(bot, SLOT + datetime.timedelta(minutes=1), worker="alive")
+        notifications._prefetched.pop(SLOT, None)
+        return bot.sent, shard_users, await get_delivered(KEY, 0), await get_abandoned_leases(KEY, KEY + 1)
+
+    sent, shard_users, delivered, abandoned = with_db(scenario)
+    assert sent == Counter({telegram_id: 1 for telegram_id in USERS if telegram_id not in shard_users[:3]})
+    assert delivered == set(shard_users)
+    assert abandoned == []
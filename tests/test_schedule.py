@@ -0,0 +1,52 @@
+from tortoise import Tortoise
+from database import users
+from database.migrations import migrate
+from database.models import Users
+from scheduler import local_utc_offset_minutes, schedule
+
+
+def test_migrates_notification_time(with_db):
+    async def scenario():
+        # Схема до перехода: время уведомления строкой "HH:MM" во времени сервера
+        conn = Tortoise.get_connection("default")
+        await conn.execute_script("DROP INDEX users_notification_slot_idx")
+        for column in ('notification_minute', 'notification_utc_minute', 'timezone'):
+            await conn.execute_script(f"ALTER TABLE users DROP COLUMN {column}")
+        await conn.execute_script("ALTER TABLE users ADD COLUMN notification_time VARCHAR(5)")
+        await conn.execute_script(
+            "INSERT INTO users (telegram_id, notification_time, notifications_enabled) VALUES (1, '08:30', 1), (2, NULL, 0)"
+        )
+        await migrate()
+        await migrate()
+        columns = {row['name'] for row in await conn.execute_query_dict("PRAGMA table_info(users)")}
+        rows = await Users.all().order_by('telegram_id').values_list('notification_minute', 'notification_utc_minute')
+        return columns, rows
+
+    columns, rows = with_db(scenario)
+    assert 'notification_time' not in columns
+    assert rows == [(510, (510 - local_utc_offset_minutes()) % 1440), (None, None)]
+
+
+def test_refresh_moves_only_zones_whose_offset_changed(with_db):
+    async def scenario():
+        for telegram_id, timezone in ((1, "America/St_Johns"), (2, "Asia/Kolkata")):
+            await users.add_user(telegram_id, None, None, None)
+            await users.update_user_notification_time(telegram_id, "09:00", city="Москва", timezone=timezone)
+        schedule.load(await users.get_notification_schedule())
+        # Будто слот пользователя 1 посчитан до перевода часов, на час раньше нынешнего смещения
+        real = local_utc_offset_minutes("America/St_Johns")
+        stale = (540 - real - 60) % 1440
+        await Users.filter(telegram_id=1).update(notification_utc_minute=stale)
+        schedule.add(1, stale, "Москва")
+        users._offsets["America/St_Johns"] = real + 60
+        moved = await users.refresh_utc_minutes()
+        again = await users.refresh_utc_minutes()
+        stored = await Users.all().order_by('telegram_id').values_list('notification_utc_minute', flat=True)
+        return moved, again, stored, schedule.due((540 - real) % 1440), stale
+
+    moved, again, stored, due, stale = with_db(scenario)
+    assert (moved, again) == (1, 0)
+    assert stored[0] == (540 - local_utc_offset_minutes("America/St_Johns")) % 1440
+    assert stored[1] == (540 - 330) % 1440
+    assert (1, "Москва", None) in due
+    assert stale != stored[0]
@@ -0,0 +1,53 @@
+from aiogram.fsm.storage.base import StorageKey
+from database.models import FSMRecord
+from database.storage import TortoiseStorage
+from metrics import db_query_duration
+
+KEY = StorageKey(bot_id=1, chat_id=5, user_id=5)
+
+
+def queries(name: str) -> int:
+    return sum(db_query_duration._counts.get((name,), []))
+
+
+def test_sticky_reads_from_cache_and_writes_in_batches(with_db):
+    async def scenario():
+        storage = TortoiseStorage(routing="sticky", flush_interval=60)
+        loads = queries('fsm_load')
+        await storage.set_state(KEY, "waiting_city")
+        await storage.set_data(KEY, {"city": "Москва"})
+        for _ in range(10):
+            await storage.get_state(KEY)
+        before_flush = await FSMRecord.all().count()
+        await storage.close()
+        row = await FSMRecord.get()
+        return queries('fsm_load') - loads, before_flush, (row.state, row.data)
+
+    loads, before_flush, row = with_db(scenario)
+    assert loads == 1
+    assert before_flush == 0
+    assert row == ("waiting_city", {"city": "Москва"})
+
+
+def test_shared_sees_other_replica(with_db):
+    async def scenario():
+        first, second = TortoiseStorage(routing="shared"), TortoiseStorage(routing="shared")
+        await first.set_state(KEY, "S1")
+        seen = [await second.get_state(KEY)]
+        await first.set_state(KEY, "S2")
+        seen.append(await second.get_state(KEY))
+        await first.close()
+        await second.close()
+        return seen
+
+    assert with_db(scenario) == ["S1", "S2"]
+
+
+def test_state_survives_restart(with_db):
+    async def scenario():
+        storage = TortoiseStorage(routing="sticky")
+        await storage.set_state(KEY, "waiting_time")
+        await storage.close()
+        return await TortoiseStorage(routing="sticky").get_state(KEY)
+
+    assert with_db(scenario) == "waiting_time"
@@ -0,0 +1,31 @@
+import pytest
+from database.models import Users
+from database.users import add_user, update_user_city, upsert_users
+
+
+def test_upsert_keeps_fields_missing_from_the_row(with_db):
+    async def scenario():
+        await add_user(1, "one", None, None)
+        await add_user(2, "two", None, None)
+        await update_user_city(2, "Москва")
+        await upsert_users([
+            {'telegram_id': 1, 'first_name': 'Иван'},
+            {'telegram_id': 2, 'username': 'newname'},
+            {'telegram_id': 3, 'username': 'three'},
+        ])
+        return await Users.all().order_by('telegram_id').values_list('telegram_id', 'username', 'first_name', 'city')
+
+    assert with_db(scenario) == [
+        (1, 'one', 'Иван', None),
+        (2, 'newname', None, 'Москва'),
+        (3, 'three', None, None),
+    ]
+
+
+def test_upsert_rejects_schedule_fields(with_db):
+    async def scenario():
+        with pytest.raises(ValueError):
+            await upsert_users([{'telegram_id': 1, 'city': 'Казань'}])
+        return await Users.all().count()
+
+    assert with_db(scenario) == 0
@@ -0,0 +1,39 @@
+import asyncio
+import json
+from pathlib import Path
+import pytest
+import views
+import weather
+from upstream import UpstreamUnavailable
+from weather_models import Forecast
+
+FORECAST = Forecast.from_api(json.loads((Path(__file__).parent.parent / "bench" / "fixtures" / "forecast.json").read_text()))
+
+
+@pytest.fixture
+def upstream_down(monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise UpstreamUnavailable("Предохранитель OpenWeather открыт")
+
+    monkeypatch.setattr(weather, "_request", unavailable)
+    weather.forecast_cache.clear()
+    yield
+    weather.forecast_cache.clear()
+
+
+def test_stale_forecast_is_marked_with_its_age(upstream_down):
+    # Снимок просрочен 10 минут назад, но ещё в пределах stale_ttl
+    weather.forecast_cache.set(weather._forecast_key("Москва", None, None, 'metric', 'ru'), FORECAST, ttl=-600)
+    text = asyncio.run(views.render_forecast(views.WeatherView(city="Москва")))
+    assert "данные получены" in text
+
+
+def test_fresh_forecast_has_no_age_note(upstream_down):
+    weather.forecast_cache.set(weather._forecast_key(None, 55.75, 37.62, 'metric', 'ru'), FORECAST)
+    text = asyncio.run(views.render_forecast(views.WeatherView(city="Москва", lat=55.75, lon=37.62)))
+    assert "данные получены" not in text
+
+
+def test_forecast_without_cache_raises(upstream_down):
+    with pytest.raises(UpstreamUnavailable):
+        asyncio.run(weather.fetch_forecast(city="Казань"))
@@ -0,0 +1,108 @@
+import asyncio
+import copy
+import json
+import os
+import signal
+from pathlib import Path
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+import webhook
+from webhook import UpdatePipeline, create_app
+
+FIXTURE = json.loads((Path(__file__).parent / "fixtures" / "update.json").read_text())
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    update = copy.deepcopy(FIXTURE)
+    update["update_id"] = update_id
+    update["message"]["message_id"] = update_id
+    update["message"]["chat"]["id"] = chat_id
+    update["message"]["from"]["id"] = chat_id
+    update["message"]["text"] = text
+    return update
+
+
+def make_dispatcher(seen: list) -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message()
+    async def record(message: Message) -> None:
+        # Первые апдейты обрабатываются дольше: без очереди на чат они бы обогнались
+        await asyncio.sleep(0.05 / int(message.text))
+        seen.append((message.chat.id, int(message.text)))
+
+    return dp
+
+
+def test_per_chat_order():
+    async def scenario():
+        seen = []
+        pipeline = UpdatePipeline(make_dispatcher(seen), Bot("123456:TEST"), workers=4, queue_size=100)
+        pipeline.start()
+        async with TestClient(TestServer(create_app(pipeline, path="/webhook", secret=None))) as client:
+            update_id = 0
+            for n in range(1, 6):
+                for chat_id in (1001, 1002, 1003):
+                    update_id += 1
+                    response = await client.post("/webhook", json=make_update(update_id, chat_id, str(n)))
+                    assert response.status == 200
+            await pipeline.stop()
+        await pipeline.bot.session.close()
+        return seen, pipeline
+
+    seen, pipeline = asyncio.run(scenario())
+    assert pipeline.processed == 15
+    for chat_id in (1001, 1002, 1003):
+        assert [n for chat, n in seen if chat == chat_id] == [1, 2, 3, 4, 5]
+
+
+def test_backpressure_returns_429():
+    async def scenario():
+        # Воркеры не запущены: очередь на одно место заполняется первым же апдейтом
+        pipeline = UpdatePipeline(make_dispatcher([]), Bot("123456:TEST"), workers=1, queue_size=1)
+        async with TestClient(TestServer(create_app(pipeline, path="/webhook", secret=None))) as client:
+            first = await client.post("/webhook", json=make_update(1, 1001, "1"))
+            second = await client.post("/webhook", json=make_update(2, 1001, "2"))
+            statuses = first.status, second.status, second.headers.get("Retry-After")
+        await pipeline.bot.session.close()
+        return statuses, pipeline
+
+    (first, second, retry_after), pipeline = asyncio.run(scenario())
+    assert (first, second, retry_after) == (200, 429, "1")
+    assert pipeline.rejected == 1
+
+
+def test_secret_and_bad_body():
+    async def scenario():
+        pipeline = UpdatePipeline(make_dispatcher([]), Bot("123456:TEST"), workers=1, queue_size=10)
+        async with TestClient(TestServer(create_app(pipeline, path="/webhook", secret="s3cret"))) as client:
+            headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+            wrong = await client.post("/webhook", json=FIXTURE, headers={"X-Telegram-Bot-Api-Secret-Token": "x"})
+            garbage = await client.post("/webhook", data="{not json", headers=headers)
+            array = await client.post("/webhook", json=[FIXTURE], headers=headers)
+            statuses = wrong.status, garbage.status, array.status
+        await pipeline.bot.session.close()
+        return statuses, pipeline
+
+    statuses, pipeline = asyncio.run(scenario())
+    assert statuses == (401, 400, 400)
+    assert pipeline.qsize() == 0
+
+
+def test_sigterm_runs_shutdown(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_PORT", 0)
+    monkeypatch.setattr(webhook, "WEBHOOK_URL", None)
+
+    async def scenario():
+        dp = Dispatcher()
+        started, events = asyncio.Event(), []
+        dp.startup.register(started.set)
+        dp.shutdown.register(lambda: events.append("shutdown"))
+        task = asyncio.create_task(webhook.run_webhook(dp, Bot("123456:TEST")))
+        await asyncio.wait_for(started.wait(), 5)
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(task, 5)
+        return events
+
+    assert asyncio.run(scenario()) == ["shutdown"]
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional
+import aiohttp
+from config import (
+    OPENWEATHER_CALLS_PER_MINUTE,
+    OPENWEATHER_BURST,
+    OPENWEATHER_INTERACTIVE_RESERVE,
+    OPENWEATHER_INTERACTIVE_WAIT,
+    OPENWEATHER_SCHEDULED_WAIT,
+    OPENWEATHER_RETRIES,
+    OPENWEATHER_BACKOFF,
+    OPENWEATHER_BACKOFF_MAX,
+    OPENWEATHER_BREAKER_THRESHOLD,
+    OPENWEATHER_BREAKER_RESET,
+)
+from openweather import OpenWeatherError
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: запросы пользователей важнее плановой рассылки
+INTERACTIVE = 0
+SCHEDULED = 1
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, OpenWeatherError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+            self._probing = False
+        if self.state == 'half_open' and not self._probing:
+            # В полуоткрытом состоянии пропускаем один пробный запрос
+            self._probing = True
+            return True
+        return False
+
+    def release(self) -> None:
+        # Пробный запрос не был отправлен — разрешаем следующую попытку
+        self._probing = False
+
+    def record_success(self) -> None:
+        if self.state != 'closed':
+            logger.info("OpenWeather снова отвечает, предохранитель закрыт")
+        self.state = 'closed'
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.threshold:
+            if self.state != 'open':
+                logger.warning(f"OpenWeather недоступен, предохранитель открыт на {self.reset_timeout:.0f} с")
+            self.state = 'open'
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class PriorityLimiter:
+    def __init__(self, bucket: TokenBucket, reserve: float):
+        self.bucket = bucket
+        # Плановые запросы не опускают бакет ниже резерва и ждут, пока есть интерактивные
+        self.reserve = min(reserve, bucket.capacity - 1)
+        self._waiting = [0, 0]
+
+    async def acquire(self, priority: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        floor = 0 if priority == INTERACTIVE else self.reserve
+        self._waiting[priority] += 1
+        try:
+            while True:
+                blocked = priority == SCHEDULED and self._waiting[INTERACTIVE] > 0
+                if not blocked and self.bucket.tokens >= floor + 1 and self.bucket.try_acquire():
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                delay = max((floor + 1 - self.bucket.tokens) / self.bucket.rate, 0.01)
+                await asyncio.sleep(min(delay, remaining))
+        finally:
+            self._waiting[priority] -= 1
+
+
+class UpstreamGuard:
+    def __init__(
+        self,
+        calls_per_minute: float = OPENWEATHER_CALLS_PER_MINUTE,
+        burst: float = OPENWEATHER_BURST,
+        reserve: float = OPENWEATHER_INTERACTIVE_RESERVE,
+        interactive_wait: float = OPENWEATHER_INTERACTIVE_WAIT,
+        scheduled_wait: float = OPENWEATHER_SCHEDULED_WAIT,
+        retries: int = OPENWEATHER_RETRIES,
+        backoff: float = OPENWEATHER_BACKOFF,
+        backoff_max: float = OPENWEATHER_BACKOFF_MAX,
+        breaker_threshold: int = OPENWEATHER_BREAKER_THRESHOLD,
+        breaker_reset: float = OPENWEATHER_BREAKER_RESET,
+    ):
+        self.limiter = PriorityLimiter(TokenBucket(calls_per_minute / 60, burst), reserve)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.waits = (interactive_wait, scheduled_wait)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+    async def call(self, factory: Callable[[], Awaitable[Any]], priority: int = INTERACTIVE) -> Any:
+        last_error: Optional[BaseException] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Экспоненциальная задержка с полным джиттером, чтобы повторы не шли волной
+                await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt)))
+            if not self.breaker.allow():
+                raise UpstreamUnavailable("Предохранитель OpenWeather открыт") from last_error
+            if not await self.limiter.acquire(priority, self.waits[priority]):
+                self.breaker.release()
+                raise UpstreamUnavailable("Исчерпана квота запросов к OpenWeather") from last_error
+            try:
+                result = await factory()
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # Ответ вроде 404 — сервис работает, ошибка относится к запросу
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                last_error = e
+                logger.warning(f"Ошибка OpenWeather (попытка {attempt + 1}/{self.retries + 1}): {e}")
+                continue
+            self.breaker.record_success()
+            return result
+        raise UpstreamUnavailable(f"OpenWeather не ответил после {self.retries + 1} попыток") from last_error
+
+
+guard = UpstreamGuard()
@@ -0,0 +1,76 @@
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+from cache import TTLCache
+from callbacks import CityRef
+from config import FORECAST_CACHE_TTL, VIEW_CACHE_SIZE, VIEW_CACHE_TTL, WEATHER_CACHE_TTL
+from formatting import format_forecast
+from metrics import register_cache
+from weather import fetch_forecast, forecast_age_note, get_location_weather, get_weather
+from weather_models import Forecast
+
+
+@dataclass
+class WeatherView:
+    # Данные, из которых построено сообщение: погода уже отрисована, прогноз
+    # подгружается при первом нажатии и переиспользуется, пока не старше TTL своего кэша
+    city: str
+    weather_text: Optional[str] = None
+    forecast: Optional[Forecast] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    weather_at: float = field(default_factory=time.monotonic)
+    forecast_at: float = 0.0
+
+
+# (chat_id, message_id) -> WeatherView
+view_cache = TTLCache(maxsize=VIEW_CACHE_SIZE, ttl=VIEW_CACHE_TTL)
+register_cache('view', view_cache)
+
+
+def view_for(ref: CityRef) -> WeatherView:
+    return WeatherView(city=ref.city, lat=ref.lat, lon=ref.lon)
+
+
+def remember_view(chat_id: int, message_id: int, view: WeatherView) -> None:
+    view_cache.set((chat_id, message_id), view)
+
+
+def get_view(chat_id: int, message_id: int) -> Optional[WeatherView]:
+    return view_cache.get((chat_id, message_id))
+
+
+async def render_weather(view: WeatherView) -> str:
+    # Устаревший снимок берется заново через кэш: там он свежий или с отметкой о возрасте
+    if view.weather_text is None or time.monotonic() - view.weather_at > WEATHER_CACHE_TTL:
+        if view.lat is not None:
+            view.weather_text = (await get_location_weather(view.lat, view.lon)).text
+        else:
+            view.weather_text = await get_weather(view.city)
+        view.weather_at = time.monotonic()
+    return view.weather_text
+
+
+async def load_forecast(view: WeatherView) -> Forecast:
+    if view.forecast is None or time.monotonic() - view.forecast_at > FORECAST_CACHE_TTL:
+        if view.lat is not None:
+            view.forecast = await fetch_forecast(lat=view.lat, lon=view.lon)
+        else:
+            view.forecast = await fetch_forecast(city=view.city)
+        view.forecast_at = time.monotonic()
+    return view.forecast
+
+
+def forecast_city(view: WeatherView) -> str:
+    # Для геолокации подписываем прогноз городом, который нашел OpenWeather
+    return view.forecast.city_name if view.lat is not None else view.city
+
+
+async def render_forecast(view: WeatherView) -> str:
+    await load_forecast(view)
+    # Прогноз, отданный из кэша при недоступном OpenWeather, помечается его возрастом
+    if view.lat is not None:
+        note = forecast_age_note(lat=view.lat, lon=view.lon)
+    else:
+        note = forecast_age_note(city=view.city)
+    return format_forecast(view.forecast, forecast_city(view)) + note
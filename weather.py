@@ -1,206 +1,268 @@
-import aiohttp
-import matplotlib.pyplot as plt
-import io
-from datetime import datetime
-from config import OPENWEATHER_API_KEY, OPENWEATHER_API_URL, OPENWEATHER_FORECAST_URL
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+from config import (
+    OPENWEATHER_API_URL,
+    OPENWEATHER_FORECAST_URL,
+    OPENWEATHER_GROUP_URL,
+    OPENWEATHER_GROUP_LIMIT,
+    WEATHER_CACHE_TTL,
+    WEATHER_CACHE_SIZE,
+    FORECAST_CACHE_TTL,
+    FORECAST_CACHE_SIZE,
+    CHART_CACHE_TTL,
+    CHART_CACHE_SIZE,
+    LOCATION_GRID_STEP,
+    LOCATION_CACHE_TTL,
+    LOCATION_CACHE_SIZE,
+    OPENWEATHER_STALE_TTL,
+)
+from openweather import get_client
+from cache import TTLCache, SingleFlight
+from metrics import register_cache
+from upstream import guard, UpstreamUnavailable, INTERACTIVE
+from charts import render_temperature_chart
+from formatting import format_current_weather, format_location_weather
+from weather_models import CurrentWeather, Forecast
 
-async def get_weather(city: str) -> str:
-    params = {
-        'q': city,
-        'appid': OPENWEATHER_API_KEY,
-        'units': 'metric',  
-        'lang': 'ru'  
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(OPENWEATHER_API_URL, params=params) as response:
-            if response.status != 200:
-                raise Exception(f"Не удалось получить данные о погоде. Код ошибки: {response.status}")
-            
-            data = await response.json()
-            
-            weather_description = data['weather'][0]['description']
-            temperature = data['main']['temp']
-            feels_like = data['main']['feels_like']
-            humidity = data['main']['humidity']
-            pressure = data['main']['pressure']
-            wind_speed = data['wind']['speed']
-            
-            weather_info = (
-                f"🏙 Погода в городе {city}:\n\n"
-                f"🌡 Температура: {temperature}°C\n"
-                f"🌡 Ощущается как: {feels_like}°C\n"
-                f"☁️ Описание: {weather_description}\n"
-                f"💧 Влажность: {humidity}%\n"
-                f"🌪 Скорость ветра: {wind_speed} м/с\n"
-                f"🔵 Давление: {pressure} гПа"
-            )
-            
-            return weather_info
-
-
-async def get_weather_by_coords(lat: float, lon: float) -> str:
-    params = {
-        'lat': lat,
-        'lon': lon,
-        'appid': OPENWEATHER_API_KEY,
-        'units': 'metric',
-        'lang': 'ru'
-    }
+logger = logging.getLogger(__name__)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(OPENWEATHER_API_URL, params=params) as response:
-            if response.status != 200:
-                raise Exception(f"Ошибка получения данных. Код: {response.status}")
+# Просроченные снимки хранятся ещё OPENWEATHER_STALE_TTL и отдаются, если OpenWeather недоступен
+weather_cache = TTLCache(maxsize=WEATHER_CACHE_SIZE, ttl=WEATHER_CACHE_TTL, stale_ttl=OPENWEATHER_STALE_TTL)
+forecast_cache = TTLCache(maxsize=FORECAST_CACHE_SIZE, ttl=FORECAST_CACHE_TTL, stale_ttl=OPENWEATHER_STALE_TTL)
+chart_cache = TTLCache(maxsize=CHART_CACHE_SIZE, ttl=CHART_CACHE_TTL)
+location_cache = TTLCache(maxsize=LOCATION_CACHE_SIZE, ttl=LOCATION_CACHE_TTL, stale_ttl=OPENWEATHER_STALE_TTL)
+inflight = SingleFlight()
 
-            data = await response.json()
+register_cache('weather', weather_cache)
+register_cache('forecast', forecast_cache)
+register_cache('chart', chart_cache)
+register_cache('location', location_cache)
 
-            city_name = data.get('name', 'неизвестный город')
 
-            weather_description = data['weather'][0]['description']
-            temperature = data['main']['temp']
-            feels_like = data['main']['feels_like']
-            humidity = data['main']['humidity']
-            pressure = data['main']['pressure']
-            wind_speed = data['wind']['speed']
+def normalize_city(city: str) -> str:
+    return ' '.join(city.split()).casefold().replace('ё', 'е')
 
-            weather_info = (
-                f"📍 Погода по вашему местоположению ({city_name}):\n\n"
-                f"🌡 Температура: {temperature}°C\n"
-                f"🌡 Ощущается как: {feels_like}°C\n"
-                f"☁️ Описание: {weather_description}\n"
-                f"💧 Влажность: {humidity}%\n"
-                f"🌪 Скорость ветра: {wind_speed} м/с\n"
-                f"🔵 Давление: {pressure} гПа"
-            )
 
-            return weather_info
+def snap_to_grid(lat: float, lon: float, step: float = LOCATION_GRID_STEP) -> Tuple[float, float]:
+    return round(round(lat / step) * step, 4), round(round(lon / step) * step, 4)
+
+
+async def _request(url: str, params: Dict, error_message: str, priority: int) -> Dict:
+    return await guard.call(lambda: get_client().get_json(url, params, error_message), priority)
+
+
+def _serve_stale(cache: TTLCache, key: Tuple, error: UpstreamUnavailable):
+    value = cache.get_stale(key)
+    if value is None:
+        raise error
+    logger.warning(f"{error}, отдаём данные из кэша для {key}")
+    return value
+
+
+def _age_note(cache: TTLCache, key: Tuple) -> str:
+    age = cache.stale_age(key)
+    if age is None:
+        return ""
+    return f"\n\n⚠️ Сервис погоды временно недоступен, данные получены {max(1, int(age // 60))} мин назад"
+
+
+def weather_age_note(weather: CurrentWeather, units: str = 'metric', lang: str = 'ru') -> str:
+    if weather.city_id is None:
+        return ""
+    return _age_note(weather_cache, ('id', weather.city_id, units, lang))
+
+
+def _forecast_key(city: Optional[str], lat: Optional[float], lon: Optional[float], units: str, lang: str) -> Tuple:
+    if city is not None:
+        return ('city', normalize_city(city), units, lang)
+    return ('coords',) + snap_to_grid(lat, lon) + (units, lang)
+
+
+def forecast_age_note(city: Optional[str] = None, lat: Optional[float] = None, lon: Optional[float] = None,
+                      units: str = 'metric', lang: str = 'ru') -> str:
+    return _age_note(forecast_cache, _forecast_key(city, lat, lon, units, lang))
+
+
+def needs_refresh(city: Optional[str] = None, city_id: Optional[int] = None, fresh_for: float = 0.0,
+                  units: str = 'metric', lang: str = 'ru') -> bool:
+    # Истечёт ли снимок города раньше, чем через fresh_for секунд
+    key = ('id', city_id, units, lang) if city_id is not None else (normalize_city(city), units, lang)
+    return weather_cache.ttl_left(key) <= fresh_for
+
+
+async def fetch_current_weather(city: str, units: str = 'metric', lang: str = 'ru',
+                                priority: int = INTERACTIVE, refresh: bool = False) -> CurrentWeather:
+    key = (normalize_city(city), units, lang)
+    weather = None if refresh else weather_cache.get(key)
+    if weather is not None:
+        return weather
 
-async def get_weather_forecast(city: str) -> str:
-    params = {
-        'q': city,
-        'appid': OPENWEATHER_API_KEY,
-        'units': 'metric',
-        'lang': 'ru'
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(OPENWEATHER_FORECAST_URL, params=params) as response:
-            if response.status != 200:
-                raise Exception(f"Не удалось получить прогноз погоды. Код ошибки: {response.status}")
-            
-            data = await response.json()
-            
-            # Группируем прогноз по дням
-            daily_forecasts = {}
-            for item in data['list']:
-                date = item['dt_txt'].split()[0]  # Получаем только дату
-                if date not in daily_forecasts:
-                    daily_forecasts[date] = {
-                        'temp_min': item['main']['temp_min'],
-                        'temp_max': item['main']['temp_max'],
-                        'description': item['weather'][0]['description'],
-                        'humidity': item['main']['humidity'],
-                        'wind_speed': item['wind']['speed']
-                    }
-            
-            # Формируем текст прогноза
-            forecast_text = f"📅 Прогноз погоды в городе {city} на 5 дней:\n\n"
-            
-            for date, forecast in list(daily_forecasts.items())[:5]:  # Берем только 5 дней
-                forecast_text += (
-                    f"📆 {date}\n"
-                    f"🌡 Температура: {forecast['temp_min']:.1f}°C - {forecast['temp_max']:.1f}°C\n"
-                    f"☁️ {forecast['description']}\n"
-                    f"💧 Влажность: {forecast['humidity']}%\n"
-                    f"🌪 Ветер: {forecast['wind_speed']} м/с\n\n"
-                )
-            
-            return forecast_text
-
-async def create_temperature_graph(city: str) -> bytes:
     params = {
         'q': city,
-        'appid': OPENWEATHER_API_KEY,
-        'units': 'metric',
-        'lang': 'ru'
+        'units': units,
+        'lang': lang
     }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(OPENWEATHER_FORECAST_URL, params=params) as response:
-            if response.status != 200:
-                raise Exception(f"Не удалось получить прогноз погоды. Код ошибки: {response.status}")
-            
-            data = await response.json()
-            
-            # Создаем списки для данных
-            times = []
-            temps = []
-            
-            # Собираем данные
-            for item in data['list']:
-                dt = datetime.strptime(item['dt_txt'], '%Y-%m-%d %H:%M:%S')
-                times.append(dt)
-                temps.append(item['main']['temp'])
-            
-            # Создаем график
-            plt.figure(figsize=(12, 6))
-            plt.plot(times, temps, marker='o')
-            plt.title(f'Прогноз температуры в городе {city}')
-            plt.xlabel('Время')
-            plt.ylabel('Температура (°C)')
-            plt.grid(True)
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            
-            # Сохраняем график в байты
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            plt.close()
-            
-            return buf.getvalue()
-
-async def get_weather_forecast_by_coords(lat: float, lon: float) -> str:
+
+    async def load() -> CurrentWeather:
+        data = await _request(OPENWEATHER_API_URL, params, "Не удалось получить данные о погоде", priority)
+        weather = CurrentWeather.from_api(data)
+        weather_cache.set(key, weather)
+        if weather.city_id is not None:
+            weather_cache.set(('id', weather.city_id, units, lang), weather)
+        return weather
+
+    try:
+        # Приоритет входит в ключ: пользовательский запрос не ждет в очереди за плановым
+        return await inflight.do(('weather', priority) + key, load)
+    except UpstreamUnavailable as e:
+        return _serve_stale(weather_cache, key, e)
+
+
+async def fetch_weather_by_ids(city_ids: Sequence[int], units: str = 'metric', lang: str = 'ru',
+                               priority: int = INTERACTIVE, refresh: bool = False) -> Dict[int, CurrentWeather]:
+    # Пачка городов по id через /group: до OPENWEATHER_GROUP_LIMIT городов за запрос
+    result: Dict[int, CurrentWeather] = {}
+    missing: List[int] = []
+    for city_id in dict.fromkeys(city_ids):
+        weather = None if refresh else weather_cache.get(('id', city_id, units, lang))
+        if weather is not None:
+            result[city_id] = weather
+        else:
+            missing.append(city_id)
+
+    async def load(chunk: List[int]) -> None:
+        params = {'id': ','.join(map(str, chunk)), 'units': units, 'lang': lang}
+        try:
+            data = await _request(OPENWEATHER_GROUP_URL, params, "Не удалось получить погоду для группы городов", priority)
+        except Exception as e:
+            logger.error(f"Ошибка пакетного запроса погоды для {len(chunk)} городов: {e}")
+            for city_id in chunk:
+                weather = weather_cache.get_stale(('id', city_id, units, lang))
+                if weather is not None:
+                    result[city_id] = weather
+            return
+        for item in data.get('list', []):
+            weather = CurrentWeather.from_api(item)
+            if weather.city_id is not None:
+                weather_cache.set(('id', weather.city_id, units, lang), weather)
+                result[weather.city_id] = weather
+
+    chunks = [missing[i:i + OPENWEATHER_GROUP_LIMIT] for i in range(0, len(missing), OPENWEATHER_GROUP_LIMIT)]
+    await asyncio.gather(*(load(chunk) for chunk in chunks))
+    return result
+
+
+async def get_weather(city: str, units: str = 'metric', lang: str = 'ru') -> str:
+    weather = await fetch_current_weather(city, units, lang)
+    return format_current_weather(weather, city, lang) + _age_note(weather_cache, (normalize_city(city), units, lang))
+
+
+@dataclass
+class LocationWeather:
+    city_name: str
+    city_id: Optional[int]
+    lat: float
+    lon: float
+    text: str
+
+
+async def fetch_weather_by_coords(lat: float, lon: float, units: str = 'metric', lang: str = 'ru') -> CurrentWeather:
+    lat, lon = snap_to_grid(lat, lon)
+    key = (lat, lon, units, lang)
+    weather = location_cache.get(key)
+    if weather is not None:
+        return weather
+
     params = {
         'lat': lat,
         'lon': lon,
-        'appid': OPENWEATHER_API_KEY,
-        'units': 'metric',
-        'lang': 'ru'
+        'units': units,
+        'lang': lang
     }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(OPENWEATHER_FORECAST_URL, params=params) as response:
-            if response.status != 200:
-                raise Exception(f"Не удалось получить прогноз погоды. Код ошибки: {response.status}")
-            
-            data = await response.json()
-            city_name = data['city']['name']
-            
-            # Группируем прогноз по дням
-            daily_forecasts = {}
-            for item in data['list']:
-                date = item['dt_txt'].split()[0]  # Получаем только дату
-                if date not in daily_forecasts:
-                    daily_forecasts[date] = {
-                        'temp_min': item['main']['temp_min'],
-                        'temp_max': item['main']['temp_max'],
-                        'description': item['weather'][0]['description'],
-                        'humidity': item['main']['humidity'],
-                        'wind_speed': item['wind']['speed']
-                    }
-            
-            # Формируем текст прогноза
-            forecast_text = f"📅 Прогноз погоды в городе {city_name} на 5 дней:\n\n"
-            
-            for date, forecast in list(daily_forecasts.items())[:5]:  # Берем только 5 дней
-                forecast_text += (
-                    f"📆 {date}\n"
-                    f"🌡 Температура: {forecast['temp_min']:.1f}°C - {forecast['temp_max']:.1f}°C\n"
-                    f"☁️ {forecast['description']}\n"
-                    f"💧 Влажность: {forecast['humidity']}%\n"
-                    f"🌪 Ветер: {forecast['wind_speed']} м/с\n\n"
-                )
-            
-            return forecast_text
\ No newline at end of file
+
+    async def load() -> CurrentWeather:
+        data = await _request(OPENWEATHER_API_URL, params, "Ошибка получения данных", INTERACTIVE)
+        weather = CurrentWeather.from_api(data)
+        location_cache.set(key, weather)
+        return weather
+
+    try:
+        return await inflight.do(('location',) + key, load)
+    except UpstreamUnavailable as e:
+        return _serve_stale(location_cache, key, e)
+
+
+async def get_location_weather(lat: float, lon: float) -> LocationWeather:
+    weather = await fetch_weather_by_coords(lat, lon)
+    cell_lat, cell_lon = snap_to_grid(lat, lon)
+    return LocationWeather(
+        city_name=weather.city_name,
+        city_id=weather.city_id,
+        lat=cell_lat,
+        lon=cell_lon,
+        text=format_location_weather(weather) + _age_note(location_cache, (cell_lat, cell_lon, 'metric', 'ru'))
+    )
+
+
+
+async def fetch_forecast(city: Optional[str] = None, lat: Optional[float] = None, lon: Optional[float] = None,
+                         units: str = 'metric', lang: str = 'ru', priority: int = INTERACTIVE) -> Forecast:
+    key = _forecast_key(city, lat, lon, units, lang)
+    if city is not None:
+        params = {'q': city, 'units': units, 'lang': lang}
+    else:
+        params = {'lat': key[1], 'lon': key[2], 'units': units, 'lang': lang}
+
+    forecast = forecast_cache.get(key)
+    if forecast is not None:
+        return forecast
+
+    async def load() -> Forecast:
+        data = await _request(OPENWEATHER_FORECAST_URL, params, "Не удалось получить прогноз погоды", priority)
+        forecast = Forecast.from_api(data)
+        forecast_cache.set(key, forecast)
+        return forecast
+
+    try:
+        return await inflight.do(('forecast', priority) + key, load)
+    except UpstreamUnavailable as e:
+        return _serve_stale(forecast_cache, key, e)
+
+
+
+@dataclass
+class CachedChart:
+    snapshot: int
+    png: Optional[bytes] = None
+    file_id: Optional[str] = None
+
+
+async def get_temperature_chart(city: str, forecast: Optional[Forecast] = None) -> CachedChart:
+    # Снимок прогноза, по которому уже построено сообщение, можно передать готовым
+    if forecast is None:
+        forecast = await fetch_forecast(city=city)
+    key = normalize_city(city)
+    times = [point.time for point in forecast.points]
+    temps = [point.temp for point in forecast.points]
+    # График привязан к точкам прогноза, а не к его циклу: при обновлении прогноза
+    # внутри трехчасового шага он перерисовывается вместе с текстом
+    snapshot = hash((tuple(times), tuple(temps)))
+
+    chart = chart_cache.get(key)
+    if chart is not None and chart.snapshot == snapshot:
+        return chart
+
+    async def render() -> CachedChart:
+        chart = CachedChart(snapshot=snapshot, png=await render_temperature_chart(city, times, temps))
+        chart_cache.set(key, chart)
+        return chart
+
+    return await inflight.do(('chart', key, snapshot), render)
+
+
+def remember_chart_file_id(chart: CachedChart, file_id: str) -> None:
+    # После загрузки в Telegram байты больше не нужны: повторно шлём по file_id
+    chart.file_id = file_id
+    chart.png = None
@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+# Снимки неизменяемы и сравниваются по ссылке: один объект живёт в кэше весь TTL,
+# поэтому по нему же мемоизируется отрисованный текст.
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class CurrentWeather:
+    city_name: str
+    city_id: Optional[int]
+    lat: float
+    lon: float
+    time: datetime
+    description: str
+    temp: float
+    feels_like: float
+    humidity: int
+    pressure: int
+    wind_speed: float
+
+    @classmethod
+    def from_api(cls, data: Dict[str, Any]) -> "CurrentWeather":
+        coord = data.get('coord', {})
+        return cls(
+            city_name=data.get('name') or 'неизвестный город',
+            city_id=data.get('id') or None,
+            lat=coord.get('lat', 0.0),
+            lon=coord.get('lon', 0.0),
+            time=datetime.fromtimestamp(data.get('dt', 0)),
+            description=data['weather'][0]['description'],
+            temp=data['main']['temp'],
+            feels_like=data['main']['feels_like'],
+            humidity=data['main']['humidity'],
+            pressure=data['main']['pressure'],
+            wind_speed=data['wind']['speed'],
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ForecastPoint:
+    time: datetime
+    temp: float
+    temp_min: float
+    temp_max: float
+    description: str
+    humidity: int
+    wind_speed: float
+    precipitation: float
+
+    @classmethod
+    def from_api(cls, item: Dict[str, Any]) -> "ForecastPoint":
+        return cls(
+            time=datetime.strptime(item['dt_txt'], '%Y-%m-%d %H:%M:%S'),
+            temp=item['main']['temp'],
+            temp_min=item['main']['temp_min'],
+            temp_max=item['main']['temp_max'],
+            description=item['weather'][0]['description'],
+            humidity=item['main']['humidity'],
+            wind_speed=item['wind']['speed'],
+            precipitation=item.get('rain', {}).get('3h', 0.0) + item.get('snow', {}).get('3h', 0.0),
+        )
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class Forecast:
+    city_name: str
+    city_id: Optional[int]
+    points: Tuple[ForecastPoint, ...]
+
+    @classmethod
+    def from_api(cls, data: Dict[str, Any]) -> "Forecast":
+        return cls(
+            city_name=data['city']['name'],
+            city_id=data['city'].get('id') or None,
+            points=tuple(ForecastPoint.from_api(item) for item in data['list']),
+        )
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import signal
+from contextlib import suppress
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_chat_key(update: Dict[str, Any]) -> int:
+    # Чат из любого типа события: message, callback_query, my_chat_member и т.д.
+    for name, event in update.items():
+        if name == 'update_id' or not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+    return update.get('update_id', 0)
+
+
+class UpdatePipeline:
+    # Каждый чат закреплён за одним воркером, поэтому его апдейты
+    # обрабатываются строго по очереди, а разные чаты — параллельно
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE):
+        self.dp = dp
+        self.bot = bot
+        self.processed = 0
+        self.rejected = 0
+        self._queues: List[asyncio.Queue] = [
+            asyncio.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)
+        ]
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        queue = self._queues[hash(get_chat_key(update)) % len(self._queues)]
+        try:
+            queue.put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    def qsize(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+                self.processed += 1
+            except Exception as e:
+                logger.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+            finally:
+                queue.task_done()
+
+    async def stop(self, timeout: float = 10) -> None:
+        # Даём воркерам дообработать очередь, затем останавливаем
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались обработки {self.qsize()} апдейтов при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def create_app(pipeline: UpdatePipeline, path: str = WEBHOOK_PATH,
+               secret: Optional[str] = WEBHOOK_SECRET) -> web.Application:
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Некорректный JSON")
+        if not isinstance(update, dict):
+            return web.Response(status=400, text="Ожидался объект Update")
+        if not pipeline.submit(update):
+            # Очередь переполнена: Telegram повторит доставку позже
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, stop: Optional[asyncio.Event] = None) -> None:
+    pipeline = UpdatePipeline(dp, bot)
+    runner = web.AppRunner(create_app(pipeline))
+    stop = stop or asyncio.Event()
+
+    # Как start_polling в aiogram: по SIGTERM/SIGINT выходим через finally, дообработав
+    # уже принятые апдейты и сбросив буферы FSM и ключей городов
+    loop = asyncio.get_running_loop()
+    with suppress(NotImplementedError):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+    await dp.emit_startup(bot=bot)
+    pipeline.start()
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, воркеров {WEBHOOK_WORKERS}")
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+
+    try:
+        await stop.wait()
+        logger.info("Получен сигнал остановки, завершаем вебхук")
+    finally:
+        with suppress(NotImplementedError):
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+        await runner.cleanup()
+        await pipeline.stop()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()